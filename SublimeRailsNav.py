@@ -1,95 +1,511 @@
 import os
 import re
+import time
 import sublime
 import sublime_plugin
-from recursive_glob import rglob
+import background
+import constant_index
+import file_index
+import frecency
+import partial_index
+import perf_stats
+import routes_index
+from file_index import get_index
+from match_keys import RESOURCE_SUFFIXES
+from related_files import ExactPaths, PathPrefix, PathPattern, list_directory, relative_path
 from lib.inflector import *
 
+# Shared by all commands; the inflector remembers the words it has seen
+inflector = Inflector()
+
 
 class RailsMixin:
+    # Maps the first folder of each window to the Rails root found for it
+    # and the test layout ('spec' or 'test') of that root, so that the
+    # directory tree only has to be searched once per folder.
+    rails_layouts = {}
+    # Maps each directory that holds engines (e.g. engines or components in
+    # a Rails root) to its mtime and the engine roots and test layouts found
+    # in it
+    engine_layouts = {}
+    # When the cached roots were last checked against the file system. They
+    # are checked when a command runs, but at most once every
+    # LAYOUT_CHECK_INTERVAL seconds, since on slow mounts every check is a
+    # few round trips per root.
+    layouts_checked = 0
+    LAYOUT_CHECK_INTERVAL = 5
+    # Maps window ids to the settings resolved for each window so far and
+    # the settings of the active view (which hold the project settings) they
+    # were resolved from. Entries are refreshed by the on_change callbacks of
+    # the settings objects and when another view becomes active, not on
+    # every read.
+    window_settings = {}
+    # The user and default settings, loaded once for all commands
+    plugin_settings = None
+    # The settings whose lists of directories make up a file category
+    LOCATION_CATEGORIES = {
+        'javascript_locations': ('javascripts', r'\.(?:js|coffee|erb)$'),
+        'stylesheet_locations': ('stylesheets', r'\.(?:s?css|less|sass)$')
+    }
+
     def get_setting(self, key):
-        settings = None
+        entry = self.window_settings.get(self.window.id())
         view = self.window.active_view()
+        if entry is None or (view and view.id() != entry['view_id']):
+            entry = self.watch_settings(view, entry)
+        values = entry['values']
+        if key not in values:
+            values[key] = self.resolve_setting(entry, key)
+        return values[key]
 
-        if view:
-            settings = self.window.active_view().settings()
+    def watch_settings(self, view, entry=None):
+        # Follows the settings of the active view, moving the on_change
+        # callback over from the view that was watched before (which may
+        # have been closed since). The values resolved so far are kept unless
+        # the project settings of the new view are different.
+        window_id = self.window.id()
+        view_settings = view and view.settings()
+        if entry is None:
+            entry = {'window': self.window, 'view_settings': None, 'project_settings': None, 'values': {}}
+            self.window_settings[window_id] = entry
+        elif entry['view_settings']:
+            entry['view_settings'].clear_on_change('SublimeRailsNav')
+        if view_settings:
+            view_settings.add_on_change('SublimeRailsNav', lambda: RailsMixin.settings_changed(window_id))
+        entry['view_id'] = view and view.id()
+        entry['view_settings'] = view_settings
+        if (view_settings and view_settings.get('SublimeRailsNav')) != entry['project_settings']:
+            RailsMixin.settings_changed(window_id)
+        return entry
 
-        if settings and settings.has('SublimeRailsNav') and key in settings.get('SublimeRailsNav'):
+    @classmethod
+    def resolve_setting(cls, entry, key):
+        project_settings = entry['view_settings'] and entry['view_settings'].get('SublimeRailsNav')
+        if project_settings and key in project_settings:
             # Get project-specific setting
-            dirs = settings.get('SublimeRailsNav')[key]
+            return project_settings[key]
+        # Get user-specific or default setting. Stored on RailsMixin itself
+        # rather than on the command class at hand, so that the settings are
+        # loaded and watched once for all commands.
+        if RailsMixin.plugin_settings is None:
+            RailsMixin.plugin_settings = sublime.load_settings('SublimeRailsNav.sublime-settings')
+            RailsMixin.plugin_settings.add_on_change('SublimeRailsNav', RailsMixin.settings_changed)
+        return RailsMixin.plugin_settings.get(key)
+
+    @classmethod
+    def settings_changed(cls, window_id=None):
+        # Forgets the settings of one window (if its project settings have
+        # changed) or of all windows, and drops the file lists whose
+        # directories have changed, so that they are found again the next
+        # time they are listed
+        for id, entry in list(cls.window_settings.items()):
+            if window_id is not None and id != window_id:
+                continue
+            old_values = entry['values']
+            entry['values'] = {}
+            entry['project_settings'] = entry['view_settings'] and entry['view_settings'].get('SublimeRailsNav')
+            for key, (category, file_pattern) in cls.LOCATION_CATEGORIES.items():
+                if key in old_values:
+                    value = cls.resolve_setting(entry, key)
+                    entry['values'][key] = value
+                    if value != old_values[key]:
+                        cls.invalidate_category(entry['window'], category, value or [], file_pattern)
+
+    @classmethod
+    def invalidate_category(cls, window, category, directories, file_pattern):
+        # The directories as file_index() hands them to the indexes, so that
+        # the next command finds the definition unchanged
+        directories = [os.path.join(*dir) for dir in directories]
+        for folder in window.folders():
+            layout = cls.rails_layouts.get(folder)
+            if layout:
+                for index in file_index.indexes_below(layout[0]):
+                    index.set_categories({category: (directories, file_pattern)})
+
+    def show_files(self, category):
+        # Remembered so that the file picked from the list can be recorded
+        self.listed_category = category
+        layouts = self.search_layouts()
+        self.display_root = common_directory([root for root, test_type in layouts])
+        self.paths = []
+        indexes = []
+        for root, test_type in layouts:
+            categories = self.categories(test_type)
+            self.paths.extend([relative_path(path, self.display_root) for path in
+                               self.construct_glob_paths(categories[category][0], root)])
+            indexes.append(self.file_index(root, categories))
+
+        unbuilt = [index for index in indexes if not index.is_built(category)]
+        if not unbuilt:
+            # Everything we need is already indexed, so any build still
+            # running for a previous command is no longer of interest
+            background.cancel(self.window.id())
+            start = time.time()
+            # After a checkout or the like, the lists are caught up with the
+            # git index on a worker: the lists as they were are shown right
+            # away, and replaced if anything has changed by the time the
+            # worker is done
+            catch_up = [index for index in indexes if index.git_changes_pending()]
+            with perf_stats.timed(self.__class__.__name__, 'find_files'):
+                self.files = self.find_files(indexes, category, refresh=not catch_up)
+            perf_stats.record_result(self.__class__.__name__, len(self.files), 'cache')
+            self.show_panel(self.file_selected)
+            perf_stats.record(self.__class__.__name__, 'first_result', time.time() - start)
+            if catch_up:
+                versions = [index.version for index in indexes]
+                generation = self.panel_generation
+                background.start(self.window.id(),
+                                 lambda task: self.catch_up(indexes, category, versions),
+                                 lambda files: self.caught_up(files, generation))
+            return
+
+        # The category has not been indexed yet. Rather than freezing the
+        # editor, build the lists of all categories in a single walk of each
+        # Rails root on a worker thread, so that the other list commands are
+        # served from memory afterwards. Meanwhile, the first matches are
+        # shown as soon as there are enough of them (or the first batch delay
+        # has passed), and the panel is refreshed with the complete list
+        # when the walk is done.
+        self.started = time.time()
+        self.partial_files = []
+        self.partial_panel_shown = False
+        self.partial_panel_closed = False
+        self.build_done = False
+        first_batch_size = self.get_setting('first_batch_size') or 0
+        self.first_batch_delay = self.get_setting('first_batch_delay') or 0
+        task = background.start(self.window.id(),
+                                lambda task: self.build(task, indexes, category, first_batch_size),
+                                self.build_finished)
+        if first_batch_size > 0:
+            sublime.set_timeout(lambda: self.show_first_batch(task), self.first_batch_delay)
+        sublime.status_message('Indexing %s...' % ', '.join(index.root for index in unbuilt))
+
+    def build(self, task, indexes, category, first_batch_size):
+        # Runs on a worker thread. A newer command only cancels the panel of
+        # this one; the build itself goes on, since the newer command needs
+        # the same index and waits for it. The files are only handed over to
+        # build_finished: self.files belongs to the panel of the first batch,
+        # which may still be open.
+        def build_index(index):
+            prefix = relative_path(index.root, self.display_root)
+
+            def found(name, file):
+                if name != category or task.is_cancelled():
+                    return
+                self.partial_files.append(os.path.join(prefix, file))
+                if len(self.partial_files) == first_batch_size:
+                    sublime.set_timeout(lambda: self.show_first_batch(task), 0)
+
+            if first_batch_size > 0:
+                index.build(on_found=found)
+            else:
+                index.build()
+
+        with perf_stats.timed(self.__class__.__name__, 'find_files'):
+            background.map_parallel(build_index, indexes)
+            return self.find_files(indexes, category)
+
+    def show_first_batch(self, task):
+        if task.is_cancelled() or self.build_done or self.partial_panel_shown:
+            return
+        if not self.partial_files:
+            # Nothing has been found yet, so look again a little later, until
+            # the build is done
+            sublime.set_timeout(lambda: self.show_first_batch(task), self.first_batch_delay or 50)
+            return
+        self.partial_panel_shown = True
+        self.files = list(self.partial_files)
+        self.show_panel(self.partial_file_selected)
+        perf_stats.record(self.__class__.__name__, 'first_result', time.time() - self.started)
+
+    def build_finished(self, files):
+        self.build_done = True
+        perf_stats.record_result(self.__class__.__name__, len(files), 'scan')
+        if self.partial_panel_closed:
+            # The user has already picked a file (or dismissed the list), so
+            # the complete results only serve to fill the index
+            return
+        self.files = files
+        if self.partial_panel_shown:
+            self.close_panel()
         else:
-            # Get user-specific or default setting
-            settings = sublime.load_settings('SublimeRailsNav.sublime-settings')
-            dirs = settings.get(key)
-        return dirs
+            perf_stats.record(self.__class__.__name__, 'first_result', time.time() - self.started)
+        self.show_panel(self.file_selected)
+
+    def catch_up(self, indexes, category, versions):
+        # Runs on a worker thread. Returns the files of the category if they
+        # have changed since they were shown, or None.
+        files = self.find_files(indexes, category)
+        if [index.version for index in indexes] == versions:
+            return None
+        return files
+
+    def caught_up(self, files, generation):
+        if files is None or generation != self.panel_generation:
+            # Nothing changed, or the panel has been closed or replaced
+            return
+        self.files = files
+        self.close_panel()
+        self.show_panel(self.file_selected)
 
-    def show_files(self, dirs, file_pattern='\.rb$'):
-        paths = self.construct_glob_paths(dirs)
-        self.find_files(paths, file_pattern)
+    def partial_file_selected(self, selected_index):
+        self.partial_panel_closed = True
+        self.file_selected(selected_index)
 
+    def show_panel(self, on_done):
         view = self.window.active_view()
-        if view:
-            current_file = view.file_name()
-            if self.is_listing_current_file_group(current_file):
-                self.remove_from_list(current_file)
-            else:
-                self.move_related_files_to_top(current_file)
+        with perf_stats.timed(self.__class__.__name__, 'rank'):
+            self.scores = self.frecency_scores()
+            ranked = False
+            if view and view.file_name():
+                current_file = view.file_name()
+                if self.is_listing_current_file_group(current_file):
+                    self.remove_from_list(relative_path(current_file, self.display_root))
+                else:
+                    ranked = self.move_related_files_to_top(current_file)
+            if not ranked:
+                self.files = self.by_frecency(self.files)
 
-        start_index = len(self.root) + 1
-        # Need to add a couple of spaces to avoid getting the file names cut off
-        relative_paths = map(lambda x: x[start_index:] + '  ', self.files)
+        # The files are listed relative to the display root already. Need to
+        # add a couple of spaces to avoid getting the file names cut off.
+        items = [file + '  ' for file in self.files]
+
+        with perf_stats.timed(self.__class__.__name__, 'show_quick_panel'):
+            self.window.show_quick_panel(items, self.panel_callback(on_done))
+
+    def panel_callback(self, on_done):
+        # Each panel gets a number, and a panel that has been replaced by a
+        # newer one is ignored when it reports being closed, whenever that
+        # happens to arrive
+        self.panel_generation = getattr(self, 'panel_generation', 0) + 1
+        generation = self.panel_generation
+
+        def panel_done(selected_index):
+            if generation == self.panel_generation:
+                # The panel is gone, so there is nothing left for a newer
+                # list to replace either
+                self.panel_generation += 1
+                on_done(selected_index)
+        return panel_done
+
+    def close_panel(self):
+        # Closes the panel to replace it with a newer one, without taking
+        # that for the user dismissing it
+        self.panel_generation = getattr(self, 'panel_generation', 0) + 1
+        self.window.run_command('hide_overlay')
+
+    def window_layouts(self):
+        # The Rails roots of all open folders, followed by the engines found
+        # in them, as (root, test type) pairs
+        layouts = []
+        for folder in self.window.folders():
+            layout = self.folder_layout(folder)
+            if layout and layout not in layouts:
+                layouts.append(layout)
+
+        for root, test_type in list(layouts):
+            for engine_directory in self.get_setting('engine_directories') or []:
+                for layout in self.engine_layouts_in(os.path.join(root, engine_directory)):
+                    if layout not in layouts:
+                        layouts.append(layout)
+        return layouts
+
+    def folder_layout(self, folder):
+        layout = self.rails_layouts.get(folder)
+        if layout is None:
+            root = self.rails_root(folder)
+            if not root:
+                return False
+            layout = (root, self.detect_test_type(root))
+            self.rails_layouts[folder] = layout
+        return layout
+
+    @classmethod
+    def engine_layouts_in(cls, directory):
+        # Every subdirectory with an app directory of its own is taken to be
+        # an engine. The list is only read again when the directory changes,
+        # i.e. when engines have been added or removed.
+        try:
+            mtime = os.path.getmtime(directory)
+        except OSError:
+            mtime = None
+        cached = cls.engine_layouts.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1]
 
-        self.window.show_quick_panel(relative_paths, self.file_selected)
+        layouts = []
+        if mtime is not None:
+            for name in sorted(os.listdir(directory)):
+                root = os.path.join(directory, name)
+                if os.path.isdir(os.path.join(root, 'app')):
+                    layouts.append((root, cls.detect_test_type(root)))
+        cls.engine_layouts[directory] = (mtime, layouts)
+        return layouts
 
-    def rails_root(self):
+    def current_layout(self):
+        # The root of the current file, if it is in one of them, so that
+        # related files are looked for in the same engine
+        view = self.window.active_view()
+        current_file = view and view.file_name()
+        if current_file:
+            for layout in sorted(self.layouts, key=lambda layout: -len(layout[0])):
+                if current_file.startswith(layout[0] + os.sep):
+                    return layout
+        return self.layouts[0]
+
+    def search_layouts(self):
+        if self.get_setting('search_roots') == 'all':
+            return self.layouts
+        return [(self.root, self.test_type)]
+
+    @classmethod
+    def validate_rails_layouts(cls):
+        # Forget about roots that no longer look like Rails roots or whose
+        # test layout has changed since we detected them
+        now = time.time()
+        if now - RailsMixin.layouts_checked < cls.LAYOUT_CHECK_INTERVAL:
+            return
+        # On the mixin itself rather than on cls, so that all commands share
+        # one check
+        RailsMixin.layouts_checked = now
+        for folder, (root, test_type) in cls.rails_layouts.items():
+            if not (os.path.exists(os.path.join(root, 'Gemfile')) or
+                    os.path.exists(os.path.join(root, 'Rakefile'))):
+                del cls.rails_layouts[folder]
+            elif cls.detect_test_type(root) != test_type:
+                del cls.rails_layouts[folder]
+        for directory, (mtime, layouts) in cls.engine_layouts.items():
+            for root, test_type in layouts:
+                if cls.detect_test_type(root) != test_type:
+                    del cls.engine_layouts[directory]
+                    break
+
+    @staticmethod
+    def detect_test_type(root):
+        if os.path.isdir(os.path.join(root, 'spec')):
+            # RSpec seems to be installed, so ignore the 'test' dir and search for specs
+            return 'spec'
+        else:
+            # No RSpec, so use the standard 'test' dir
+            return 'test'
+
+    def rails_root(self, folder):
         # Look for a Gemfile first, since that should always be found in the
         # root directory of a Rails 3 project. If no Gemfile is found, we
         # might have a Rails 2 (or earlier) project, so look for a Rakefile
         # instead. However, since Rakefiles may be found in subdirectories as
         # well, in that case we also check for a number for additional
         # standard Rails directories.
+        # The folder that is open is nearly always the root itself, which
+        # takes a single check
+        if os.path.exists(os.path.join(folder, 'Gemfile')):
+            return folder
+
+        directories = []
+        directory = folder
+        while directory:
+            directories.append(directory)
+            parent = os.path.realpath(os.path.join(directory, os.path.pardir))
+            if parent == directory:
+                # /.. == /
+                break
+            directory = parent
+
+        # Otherwise, since on slow file systems most of the time goes into
+        # waiting for each check, check all the candidate directories at once
+        indicators = background.map_parallel(self.root_indicators, directories)
         for root_indicator in ['Gemfile', 'Rakefile']:
-            folders = self.window.folders()
-            if len(folders) == 0:
-                return False
+            for directory, found in zip(directories, indicators):
+                if root_indicator in found:
+                    return directory
+        return False
 
-            directory = folders[0]
-            while directory:
-                if os.path.exists(os.path.join(directory, root_indicator)):
-                    if root_indicator == 'Gemfile':
-                        return directory
-                    else:
-                        looks_like_root = True
-                        for additional_dir in ['app', 'config', 'lib', 'vendor']:
-                            if not (os.path.exists(os.path.join(directory, additional_dir))):
-                                looks_like_root = False
-                                break
-                        if looks_like_root:
-                            return directory
-
-                parent = os.path.realpath(os.path.join(directory, os.path.pardir))
-                if parent == directory:
-                    # /.. == /
+    @staticmethod
+    def root_indicators(directory):
+        found = []
+        if os.path.exists(os.path.join(directory, 'Gemfile')):
+            found.append('Gemfile')
+        if os.path.exists(os.path.join(directory, 'Rakefile')):
+            looks_like_root = True
+            for additional_dir in ['app', 'config', 'lib', 'vendor']:
+                if not (os.path.exists(os.path.join(directory, additional_dir))):
+                    looks_like_root = False
                     break
-                directory = parent
-        return False
+            if looks_like_root:
+                found.append('Rakefile')
+        return found
 
-    def construct_glob_paths(self, dirs):
+    def construct_glob_paths(self, dirs, root=None):
         paths = []
         for dir in dirs:
-            paths.append(os.path.join(self.root, *dir))
+            paths.append(os.path.join(root or self.root, *dir))
         return paths
 
     def file_selected(self, selected_index):
+        category = getattr(self, 'listed_category', None)
+        self.listed_category = None
         if selected_index != -1:
+            # Listed files are relative to the display root, except in the
+            # commands that list absolute paths, which join leaves alone
+            file = os.path.join(self.display_root, self.files[selected_index])
             if self.window.num_groups() > 1:
                 self.window.focus_group((self.window.active_group() + 1) % self.window.num_groups())
-            self.window.open_file(self.files[selected_index])
-
-    def find_files(self, paths, file_pattern):
+            self.window.open_file(file)
+            if category and self.get_setting('rank_by_frecency') is not False:
+                self.record_selection(category, file)
+        # The list is put together from the index again the next time, so
+        # there is no need to hold on to it
         self.files = []
-        for path in paths:
-            self.files.extend(rglob(path, file_pattern))
+
+    def find_files(self, indexes, category, refresh=True):
+        # The files relative to the display root, which holds all the roots.
+        # Without refresh, the lists are taken as they are, without looking
+        # at the disk.
+        files = []
+        for index in indexes:
+            prefix = relative_path(index.root, self.display_root)
+            if refresh:
+                files.extend(index.find(category, prefix))
+            else:
+                files.extend(index.listed_files(category, prefix))
+        return files
+
+    def file_index(self, root=None, categories=None):
+        # Each root has an index of its own. It is kept on disk as well, so
+        # that restarting the editor does not force a cold scan of the whole
+        # project.
+        index = get_index(root or self.root, self.cache_dir())
+        index.set_excluded_directories(self.get_setting('excluded_directories'))
+        index.use_git_index = self.get_setting('use_git_index') is not False
+        if categories is None:
+            categories = self.categories()
+        index_categories = {}
+        for name, (dirs, file_pattern) in categories.items():
+            index_categories[name] = ([os.path.join(*dir) for dir in dirs], file_pattern)
+        index.set_categories(index_categories)
+        return index
+
+    def open_location(self, path, line):
+        if self.window.num_groups() > 1:
+            self.window.focus_group((self.window.active_group() + 1) % self.window.num_groups())
+        self.window.open_file('%s:%d' % (path, line), sublime.ENCODED_POSITION)
+
+    def text_under_cursor(self, pattern):
+        # Returns the match of pattern on the current line that the cursor is
+        # in (or next to), if any
+        view = self.window.active_view()
+        if not view or len(view.sel()) == 0:
+            return None
+        line = view.line(view.sel()[0].begin())
+        text = view.substr(line)
+        column = view.sel()[0].begin() - line.begin()
+        for match in re.finditer(pattern, text):
+            if match.start() <= column <= match.end():
+                return match.group(0)
+        return None
+
+    def cache_dir(self):
+        return os.path.join(sublime.packages_path(), 'User', 'SublimeRailsNav.cache')
 
     def remove_from_list(self, current_file):
         # First check to see if the current file is in the list. For instance,
@@ -101,13 +517,126 @@ class RailsMixin:
             pass
 
     def move_related_files_to_top(self, current_file):
-        related_file_name_pattern = self.construct_related_file_name_pattern(current_file)
+        related_file_matcher = self.related_file_matcher(current_file)
+
+        if related_file_matcher:
+            self.files = self.rank_files(related_file_matcher.relative_to(self.display_root))
+        return bool(related_file_matcher)
+
+    def related_file_matcher(self, current_file):
+        # Reissuing a command from the same file is common, so remember the
+        # matcher built for the last one. One list_rails_files command serves
+        # every custom category, so the category is part of the key.
+        key = (current_file, self.root, self.test_type, getattr(self, 'category', None))
+        if getattr(self, 'related_file_key', None) != key:
+            self.related_file_key = key
+            self.cached_related_file_matcher = self.construct_related_file_matcher(current_file)
+        return self.cached_related_file_matcher
+
+    def rank_files(self, related_file_matcher):
+        # Puts the related files first, followed by the other files in the
+        # directories where related files were found (e.g. the other views of
+        # a controller or the other models in a namespace) and then by
+        # everything else. Within each tier, the files opened often and
+        # recently come first; the rest keep the original order of the list.
+        related_files = []
+        other_files = []
+        related_dirs = set()
+        for file in self.files:
+            if related_file_matcher.search(file):
+                related_files.append(file)
+                related_dirs.add(os.path.dirname(file))
+            else:
+                other_files.append(file)
+
+        # Sharing one of the directories that are being listed doesn't make
+        # a file any more relevant than the rest
+        related_dirs.difference_update(self.paths)
+        if not related_dirs:
+            return self.by_frecency(related_files) + self.by_frecency(other_files)
+
+        neighbour_files = []
+        remaining_files = []
+        for file in other_files:
+            if os.path.dirname(file) in related_dirs:
+                neighbour_files.append(file)
+            else:
+                remaining_files.append(file)
+        return self.by_frecency(related_files) + self.by_frecency(neighbour_files) + \
+            self.by_frecency(remaining_files)
+
+    def frecency_scores(self):
+        # The scores of the files opened from the list being shown, for all
+        # roots being searched
+        category = getattr(self, 'listed_category', None)
+        if not category or self.get_setting('rank_by_frecency') is False:
+            return {}
+        scores = {}
+        for root, test_type in self.search_layouts():
+            store = frecency.get_store(root, self.cache_dir())
+            scores.update(store.scores(category, relative_path(root, self.display_root)))
+        return scores
+
+    def by_frecency(self, files):
+        # Stable, and only the few files that have been opened before are
+        # sorted, so that long lists cost no more than a pass over them
+        scores = getattr(self, 'scores', None)
+        if not scores:
+            return files
+        scored = [file for file in files if file in scores]
+        if not scored:
+            return files
+        scored.sort(key=lambda file: -scores[file])
+        return scored + [file for file in files if file not in scores]
 
-        if related_file_name_pattern:
-            for file in self.files:
-                if re.search(related_file_name_pattern, file):
-                    i = self.files.index(file)
-                    self.files.insert(0, self.files.pop(i))
+    def record_selection(self, category, file):
+        for root, test_type in sorted(self.layouts, key=lambda layout: -len(layout[0])):
+            if file.startswith(root + os.sep):
+                frecency.get_store(root, self.cache_dir()).record(category, file[len(root) + 1:])
+                # Written along with the indexes, so that picking several
+                # files in a row results in a single write
+                sublime.set_timeout(save_all_indexes, 2000)
+                return
+
+
+class RailsFileIndexListener(sublime_plugin.EventListener):
+    # Keeps the file indexes in sync with files that are created, renamed or
+    # deleted from within the editor, so that the lists never have to be
+    # rescanned because of them. Maps view ids to the file name each view had
+    # the last time we saw it, so that renames can be detected on save.
+    file_names = {}
+
+    def on_new(self, view):
+        self.file_names[view.id()] = None
+
+    def on_load(self, view):
+        self.file_names[view.id()] = view.file_name()
+
+    def on_post_save(self, view):
+        file_name = view.file_name()
+        old_file_name = self.file_names.get(view.id())
+        if old_file_name and old_file_name != file_name and not os.path.exists(old_file_name):
+            file_index.file_removed(old_file_name)
+            constant_index.file_removed(old_file_name)
+            partial_index.file_removed(old_file_name)
+        file_index.file_added(file_name)
+        constant_index.file_changed(file_name)
+        partial_index.file_changed(file_name, inflector)
+        self.file_names[view.id()] = file_name
+        self.schedule_save()
+
+    def on_close(self, view):
+        file_name = self.file_names.pop(view.id(), None) or view.file_name()
+        if file_name and not os.path.exists(file_name):
+            file_index.file_removed(file_name)
+            constant_index.file_removed(file_name)
+            partial_index.file_removed(file_name)
+            self.schedule_save()
+
+    def schedule_save(self):
+        # Delay writing the indexes to disk, so that a burst of saves only
+        # results in a single write
+        sublime.set_timeout(save_all_indexes, 2000)
 
 
 class RailsCommandBase(sublime_plugin.WindowCommand, RailsMixin):
@@ -118,27 +647,59 @@ class RailsCommandBase(sublime_plugin.WindowCommand, RailsMixin):
     FIXTURE_DIR = os.path.join('test', 'fixtures')
 
     def setup(self):
-        self.root = self.rails_root()
-        if not self.root:
+        perf_stats.enabled = bool(self.get_setting('performance_stats'))
+        with perf_stats.timed(self.__class__.__name__, 'setup'):
+            return self.setup_layout()
+
+    def setup_layout(self):
+        with perf_stats.timed(self.__class__.__name__, 'rails_root'):
+            # Root detection is cached, so this is where we notice a Gemfile
+            # or spec directory that has been added or removed behind our back
+            self.validate_rails_layouts()
+            self.layouts = self.window_layouts()
+        if not self.layouts:
             sublime.error_message('No Rails root directory found. Not a Rails application?')
             return False
 
-        if os.path.isdir(os.path.join(self.root, 'spec')):
-            # RSpec seems to be installed, so ignore the 'test' dir and search for specs
-            self.test_type = 'spec'
+        self.root, self.test_type = self.current_layout()
+        self.display_root = self.root
+        if self.test_type == 'spec':
             self.model_test_dir = os.path.join('spec', 'models')
             self.controller_test_dir = os.path.join('spec', 'controllers')
             self.view_test_dir = os.path.join('spec', 'views')
             self.helper_test_dir = os.path.join('spec', 'helpers')
         else:
-            # No RSpec, so use the standard 'test' dir
-            self.test_type = 'test'
             self.model_test_dir = os.path.join('test', 'unit')
             self.controller_test_dir = os.path.join('test', 'functional')
             self.helper_test_dir = os.path.join('test', 'unit', 'helpers')
         return True
 
-    def construct_related_file_name_pattern(self, current_file):
+    def categories(self, test_type=None):
+        # The kinds of files that the list commands show: the directories
+        # they are found in and the pattern their names must match. They are
+        # all indexed together.
+        categories = {
+            'models': ([['app', 'models']], r'\.rb$'),
+            'controllers': ([['app', 'controllers']], r'\.rb$'),
+            'views': ([['app', 'views']], r'\.(?:erb|haml|slim)$'),
+            'helpers': ([['app', 'helpers']], r'\.rb$'),
+            'fixtures': ([['test', 'fixtures']], r'\.yml$'),
+            'tests': ([[test_type or self.test_type]], r'\.rb$'),
+            'javascripts': (self.get_setting('javascript_locations') or [],
+                            self.LOCATION_CATEGORIES['javascript_locations'][1]),
+            'stylesheets': (self.get_setting('stylesheet_locations') or [],
+                            self.LOCATION_CATEGORIES['stylesheet_locations'][1])
+        }
+        for name, category in self.custom_categories().items():
+            if name not in categories:
+                categories[name] = (category.get('directories') or [], category.get('pattern') or r'\.rb$')
+        return categories
+
+    def custom_categories(self):
+        # The categories from the settings (services, jobs, policies, ...)
+        return self.get_setting('categories') or {}
+
+    def construct_related_file_matcher(self, current_file):
         pass
 
 
@@ -146,27 +707,27 @@ class ListRailsModelsCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        self.show_files([['app', 'models']])
+        self.show_files('models')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.CONTROLLER_DIR in current_file:
             m = re.search(r'(\w+)_controller\.\w+$', current_file)
-            singular = Inflector().singularize(m.group(1))
+            singular = inflector.singularize(m.group(1))
 
-            pattern = re.sub(self.CONTROLLER_DIR, self.MODEL_DIR, current_file)
-            pattern = re.sub(r'\w+_controller(\.\w+$)', '%s\g<1>' % singular, pattern)
-            return pattern
+            path = current_file.replace(self.CONTROLLER_DIR, self.MODEL_DIR)
+            path = re.sub(r'\w+_controller(\.\w+)$', '%s\g<1>' % singular, path)
+            return ExactPaths(path)
         elif self.FIXTURE_DIR in current_file:
             m = re.search(r'(\w+)\.yml$', current_file)
-            singular = Inflector().singularize(m.group(1))
+            singular = inflector.singularize(m.group(1))
 
-            pattern = re.sub(self.FIXTURE_DIR, self.MODEL_DIR, current_file)
-            pattern = re.sub(r'\w+.yml$', '%s.rb' % singular, pattern)
-            return pattern
+            path = current_file.replace(self.FIXTURE_DIR, self.MODEL_DIR)
+            path = re.sub(r'\w+\.yml$', '%s.rb' % singular, path)
+            return ExactPaths(path)
         elif self.model_test_dir in current_file:
-            pattern = re.sub(self.model_test_dir, self.MODEL_DIR, current_file)
-            pattern = re.sub(r'(_%s)(.\w+)$' % self.test_type, '\g<2>', pattern)
-            return pattern
+            path = current_file.replace(self.model_test_dir, self.MODEL_DIR)
+            path = re.sub(r'_%s(\.\w+)$' % self.test_type, '\g<1>', path)
+            return ExactPaths(path)
         else:
             return None
 
@@ -178,28 +739,27 @@ class ListRailsControllersCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        self.show_files([['app', 'controllers']])
+        self.show_files('controllers')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.MODEL_DIR in current_file:
             m = re.search(r'(\w+)\.\w+$', current_file)
-            plural = Inflector().pluralize(m.group(1))
+            plural = inflector.pluralize(m.group(1))
 
-            pattern = re.sub(self.MODEL_DIR, self.CONTROLLER_DIR, current_file)
-            pattern = re.sub(r'\w+(\.\w+)$', '%s_controller\g<1>' % plural, pattern)
-            return pattern
+            path = current_file.replace(self.MODEL_DIR, self.CONTROLLER_DIR)
+            path = re.sub(r'\w+(\.\w+)$', '%s_controller\g<1>' % plural, path)
+            return ExactPaths(path)
         elif self.VIEW_DIR in current_file:
-            pattern = re.sub(self.VIEW_DIR, self.CONTROLLER_DIR, current_file)
-            pattern = re.sub(os.path.join('', r'(\w+)', r'[\w\.]+$'), '\g<1>_controller', pattern)
-            return pattern
+            path = current_file.replace(self.VIEW_DIR, self.CONTROLLER_DIR)
+            return ExactPaths(os.path.dirname(path) + '_controller.rb')
         if self.HELPER_DIR in current_file:
-            pattern = re.sub(self.HELPER_DIR, self.CONTROLLER_DIR, current_file)
-            pattern = re.sub(r'_helper\.rb$', '_controller\.rb', pattern)
-            return pattern
+            path = current_file.replace(self.HELPER_DIR, self.CONTROLLER_DIR)
+            path = re.sub(r'_helper\.rb$', '_controller.rb', path)
+            return ExactPaths(path)
         elif self.controller_test_dir in current_file:
-            pattern = re.sub(self.controller_test_dir, self.CONTROLLER_DIR, current_file)
-            pattern = re.sub(r'(_%s)(.\w+)$' % self.test_type, '\g<2>', pattern)
-            return pattern
+            path = current_file.replace(self.controller_test_dir, self.CONTROLLER_DIR)
+            path = re.sub(r'_%s(\.\w+)$' % self.test_type, '\g<1>', path)
+            return ExactPaths(path)
         else:
             return None
 
@@ -211,28 +771,28 @@ class ListRailsViewsCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        self.show_files([['app', 'views']], '\.(?:erb|haml|slim)$')
+        self.show_files('views')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.CONTROLLER_DIR in current_file:
-            pattern = re.sub(self.CONTROLLER_DIR, self.VIEW_DIR, current_file)
-            pattern = re.sub(r'(\w+)_controller\.\w+$', '\g<1>' + os.sep, pattern)
-            return pattern
+            path = current_file.replace(self.CONTROLLER_DIR, self.VIEW_DIR)
+            path = re.sub(r'(\w+)_controller\.\w+$', '\g<1>', path)
+            return PathPrefix(path + os.sep)
         elif self.test_type == 'test' and self.controller_test_dir in current_file:
             # With Test::Unit, view tests are found in the controller test
             # file, so the best we can do is to show all views for the
             # controller associated with the currently active controller test
             # at the top of the list.
-            pattern = re.sub(self.controller_test_dir, self.VIEW_DIR, current_file)
-            pattern = re.sub(r'(\w+)_controller_test\.rb$', '\g<1>' + os.sep, pattern)
-            return pattern
+            path = current_file.replace(self.controller_test_dir, self.VIEW_DIR)
+            path = re.sub(r'(\w+)_controller_test\.rb$', '\g<1>', path)
+            return PathPrefix(path + os.sep)
         elif self.test_type == 'spec' and self.view_test_dir in current_file:
             # RSpec uses separate view specs, so here we can show the
             # particular view associated with the currently active spec at the
             # top of the list.
-            pattern = re.sub(self.view_test_dir, self.VIEW_DIR, current_file)
-            pattern = re.sub(r'(\w+)\.[\w\.]+$', '\g<1>\.', pattern)
-            return pattern
+            path = current_file.replace(self.view_test_dir, self.VIEW_DIR)
+            path = re.sub(r'(\w+)\.[\w\.]+$', '\g<1>.', path)
+            return PathPrefix(path)
         else:
             return None
 
@@ -244,17 +804,17 @@ class ListRailsHelpersCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        self.show_files([['app', 'helpers']])
+        self.show_files('helpers')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.CONTROLLER_DIR in current_file:
-            pattern = re.sub(self.CONTROLLER_DIR, self.HELPER_DIR, current_file)
-            pattern = re.sub(r'_controller\.rb$', '_helper\.rb', pattern)
-            return pattern
+            path = current_file.replace(self.CONTROLLER_DIR, self.HELPER_DIR)
+            path = re.sub(r'_controller\.rb$', '_helper.rb', path)
+            return ExactPaths(path)
         elif self.helper_test_dir in current_file:
-            pattern = re.sub(self.helper_test_dir, self.HELPER_DIR, current_file)
-            pattern = re.sub(r'(_%s)(.\w+)$' % self.test_type, '\g<2>', pattern)
-            return pattern
+            path = current_file.replace(self.helper_test_dir, self.HELPER_DIR)
+            path = re.sub(r'_%s(\.\w+)$' % self.test_type, '\g<1>', path)
+            return ExactPaths(path)
         else:
             return None
 
@@ -266,30 +826,30 @@ class ListRailsFixturesCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        self.show_files([['test', 'fixtures']], '\.yml$')
+        self.show_files('fixtures')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.MODEL_DIR in current_file:
             m = re.search(r'(\w+)\.rb$', current_file)
-            plural = Inflector().pluralize(m.group(1))
+            plural = inflector.pluralize(m.group(1))
 
-            pattern = re.sub(self.MODEL_DIR, self.FIXTURE_DIR, current_file)
-            pattern = re.sub(r'\w+\.rb$', r'%s\.yml' % plural, pattern)
-            return pattern
+            path = current_file.replace(self.MODEL_DIR, self.FIXTURE_DIR)
+            path = re.sub(r'\w+\.rb$', '%s.yml' % plural, path)
+            return ExactPaths(path)
         elif self.model_test_dir in current_file:
             m = re.search(r'(\w+)_%s\.rb$' % self.test_type, current_file)
-            plural = Inflector().pluralize(m.group(1))
+            plural = inflector.pluralize(m.group(1))
 
-            pattern = re.sub(self.model_test_dir, self.FIXTURE_DIR, current_file)
-            pattern = re.sub(r'(\w+)_%s\.rb$' % self.test_type, r'%s\.yml' % plural, pattern)
-            return pattern
+            path = current_file.replace(self.model_test_dir, self.FIXTURE_DIR)
+            path = re.sub(r'(\w+)_%s\.rb$' % self.test_type, '%s.yml' % plural, path)
+            return ExactPaths(path)
         elif self.controller_test_dir in current_file:
             m = re.search(r'(\w+)_controller_%s\.rb$' % self.test_type, current_file)
-            plural = Inflector().pluralize(m.group(1))
+            plural = inflector.pluralize(m.group(1))
 
-            pattern = re.sub(self.controller_test_dir, self.FIXTURE_DIR, current_file)
-            pattern = re.sub(r'(\w+)_controller_%s\.rb$' % self.test_type, r'%s\.yml' % plural, pattern)
-            return pattern
+            path = current_file.replace(self.controller_test_dir, self.FIXTURE_DIR)
+            path = re.sub(r'(\w+)_controller_%s\.rb$' % self.test_type, '%s.yml' % plural, path)
+            return ExactPaths(path)
         else:
             return None
 
@@ -302,41 +862,44 @@ class ListRailsTestsCommand(RailsCommandBase):
         if not self.setup():
             return
 
-        self.show_files([[self.test_type]])
+        self.show_files('tests')
 
-    def construct_related_file_name_pattern(self, current_file):
+    def construct_related_file_matcher(self, current_file):
         if self.MODEL_DIR in current_file:
-            pattern = re.sub(self.MODEL_DIR, self.model_test_dir, current_file)
-            pattern = re.sub(r'(\.\w+)$', '_%s\g<1>' % self.test_type, pattern)
-            return pattern
+            path = current_file.replace(self.MODEL_DIR, self.model_test_dir)
+            path = re.sub(r'(\.\w+)$', '_%s\g<1>' % self.test_type, path)
+            return ExactPaths(path)
         elif self.CONTROLLER_DIR in current_file:
-            pattern = re.sub(self.CONTROLLER_DIR, self.controller_test_dir, current_file)
-            pattern = re.sub(r'(\.\w+)$', '_%s\g<1>' % self.test_type, pattern)
-            return pattern
+            path = current_file.replace(self.CONTROLLER_DIR, self.controller_test_dir)
+            path = re.sub(r'(\.\w+)$', '_%s\g<1>' % self.test_type, path)
+            return ExactPaths(path)
         elif self.VIEW_DIR in current_file:
             if self.test_type == 'spec':
                 # RSpec uses separate view specs
-                pattern = re.sub(self.VIEW_DIR, self.view_test_dir, current_file)
-                pattern = re.sub(r'(\w+)\.[\w\.]+$', r'\g<1>[\w\.]*_spec\.rb', pattern)
+                path = current_file.replace(self.VIEW_DIR, self.view_test_dir)
+                path = re.sub(r'(\w+)\.[\w\.]+$', '\g<1>', path)
+                return PathPattern(path, r'[\w\.]*_spec\.rb')
             else:
                 # Test::Unit puts view tests in the controller test file
-                pattern = re.sub(self.VIEW_DIR, self.controller_test_dir, current_file)
-                pattern = re.sub(r'(\w+)%s[\w\.]+$' % os.sep, '\g<1>_controller_test.rb', pattern)
-            return pattern
+                path = current_file.replace(self.VIEW_DIR, self.controller_test_dir)
+                return ExactPaths(os.path.dirname(path) + '_controller_test.rb')
         elif self.HELPER_DIR in current_file:
-            pattern = re.sub(self.HELPER_DIR, self.helper_test_dir, current_file)
-            pattern = re.sub(r'\.rb$', r'_%s\.rb' % self.test_type, pattern)
-            return pattern
+            path = current_file.replace(self.HELPER_DIR, self.helper_test_dir)
+            path = re.sub(r'\.rb$', '_%s.rb' % self.test_type, path)
+            return ExactPaths(path)
         elif self.FIXTURE_DIR in current_file:
             m = re.search(r'(\w+)\.yml$', current_file)
-            singular = Inflector().singularize(m.group(1))
-
-            pattern = re.sub(self.FIXTURE_DIR, r'(?:%s|%s)' % (self.model_test_dir, self.controller_test_dir), current_file)
-            pattern = re.sub(r'(\w+)\.yml$', r'(?:\g<1>_controller|%s)_%s\.rb' % (singular, self.test_type), pattern)
-            return pattern
-        elif 'config/routes.rb' in current_file and self.test_type == 'spec':
-            pattern = os.path.join(self.root, 'spec', 'routing', '.+_routing_spec.rb')
-            return pattern
+            singular = inflector.singularize(m.group(1))
+
+            paths = []
+            for test_dir in [self.model_test_dir, self.controller_test_dir]:
+                for name in ['%s_controller' % m.group(1), singular]:
+                    path = current_file.replace(self.FIXTURE_DIR, test_dir)
+                    path = re.sub(r'(\w+)\.yml$', '%s_%s.rb' % (name, self.test_type), path)
+                    paths.append(path)
+            return ExactPaths(*paths)
+        elif os.path.join('config', 'routes.rb') in current_file and self.test_type == 'spec':
+            return PathPattern(os.path.join(self.root, 'spec', 'routing', ''), r'.+_routing_spec\.rb')
         else:
             return None
 
@@ -348,8 +911,7 @@ class ListRailsJavascriptsCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        dirs = self.get_setting('javascript_locations')
-        self.show_files(dirs, '\.(?:js|coffee|erb)$')
+        self.show_files('javascripts')
 
     def is_listing_current_file_group(self, current_file):
         return 'javascripts' in current_file
@@ -359,8 +921,403 @@ class ListRailsStylesheetsCommand(RailsCommandBase):
     def run(self):
         if not self.setup():
             return
-        dirs = self.get_setting('stylesheet_locations')
-        self.show_files(dirs, '\.(?:s?css|less|sass)$')
+        self.show_files('stylesheets')
 
     def is_listing_current_file_group(self, current_file):
         return 'stylesheets' in current_file
+
+
+class ListRailsFilesCommand(RailsCommandBase):
+    # Lists the files of a category from the categories setting, with the
+    # files that its related rules name for the current file at the top
+    def run(self, category):
+        if not self.setup():
+            return
+        if category not in self.custom_categories():
+            sublime.status_message('No category named %s in the SublimeRailsNav settings' % category)
+            return
+        self.category = category
+        self.show_files(category)
+
+    def construct_related_file_matcher(self, current_file):
+        rules = self.custom_categories().get(self.category, {}).get('related') or []
+        resource = self.resource_name(current_file)
+        if not rules or not resource:
+            return None
+        singular = inflector.singularize(resource)
+        plural = inflector.pluralize(singular)
+        paths = [os.path.join(self.root, *rule.format(singular=singular, plural=plural).split('/'))
+                 for rule in rules]
+        return ExactPaths(*paths)
+
+    def resource_name(self, current_file):
+        # The resource a file belongs to: user for user.rb,
+        # users_controller.rb, user_policy.rb and user_policy_spec.rb
+        suffixes = RESOURCE_SUFFIXES + ['_' + inflector.singularize(name) for name in self.custom_categories()]
+        name = os.path.basename(current_file).split('.')[0]
+        stripped = True
+        while stripped:
+            stripped = False
+            for suffix in suffixes:
+                if name.endswith(suffix) and len(name) > len(suffix):
+                    name = name[:-len(suffix)]
+                    stripped = True
+        return name
+
+    def is_listing_current_file_group(self, current_file):
+        for directory in self.categories()[self.category][0]:
+            if current_file.startswith(os.path.join(self.root, *directory) + os.sep):
+                return True
+        return False
+
+
+def category_command(name):
+    # Generates ListRailsServicesCommand, run as list_rails_services, for
+    # the services category
+    class_name = 'ListRails%sCommand' % ''.join([part.capitalize() for part in re.split(r'\W+|_', name)])
+
+    def run(self):
+        ListRailsFilesCommand.run(self, name)
+    return type(str(class_name), (ListRailsFilesCommand,), {'run': run})
+
+
+for category_name in sublime.load_settings('SublimeRailsNav.sublime-settings').get('categories') or {}:
+    command_class = category_command(category_name)
+    if command_class.__name__ not in globals():
+        globals()[command_class.__name__] = command_class
+
+
+class OpenRelatedRailsFileCommand(RailsCommandBase):
+    # Opens the file of the given type that corresponds to the current file
+    # (e.g. the model of a controller) without listing the whole directory.
+    # The list is only shown if there are several candidates, or none at all.
+    LIST_COMMANDS = {
+        'model': ListRailsModelsCommand,
+        'controller': ListRailsControllersCommand,
+        'view': ListRailsViewsCommand,
+        'helper': ListRailsHelpersCommand,
+        'fixture': ListRailsFixturesCommand,
+        'test': ListRailsTestsCommand
+    }
+
+    def run(self, type):
+        if type in self.LIST_COMMANDS:
+            list_command = self.LIST_COMMANDS[type](self.window)
+            list_args = ()
+        else:
+            # A category from the settings, by its singular or plural name
+            list_command = ListRailsFilesCommand(self.window)
+            list_args = (inflector.pluralize(type),)
+            list_command.category = list_args[0]
+        if not list_command.setup():
+            return
+        self.root = list_command.root
+        self.display_root = list_command.display_root
+
+        view = self.window.active_view()
+        current_file = view and view.file_name()
+        related_file_matcher = current_file and list_command.related_file_matcher(current_file)
+        if related_file_matcher:
+            self.files = related_file_matcher.candidates()
+        else:
+            self.files = []
+
+        if len(self.files) == 1:
+            self.file_selected(0)
+        elif len(self.files) > 1:
+            self.show_panel(self.file_selected)
+        else:
+            sublime.status_message('No related %s found' % type)
+            list_command.run(*list_args)
+
+    def show_panel(self, on_done):
+        # The candidates are all related to the current file, so there is no
+        # ranking to do
+        start_index = len(self.display_root) + 1
+        relative_paths = map(lambda x: x[start_index:] + '  ', self.files)
+        self.window.show_quick_panel(relative_paths, on_done)
+
+
+class SearchRailsFilesCommand(RailsCommandBase):
+    # Finds files by the names that Rails code uses for them (class names
+    # like Admin::UsersController, table names like people, namespaces)
+    # rather than by their paths. Searches all categories, or just the given
+    # one (e.g. 'models').
+    def run(self, category=None):
+        if not self.setup():
+            return
+        self.category = category
+        layouts = self.search_layouts()
+        self.display_root = common_directory([root for root, test_type in layouts])
+        self.indexes = [self.file_index(root, self.categories(test_type)) for root, test_type in layouts]
+
+        unbuilt = [index for index in self.indexes
+                   if [name for name in (category and [category] or index.categories)
+                       if not index.is_built(name)]]
+        if not unbuilt:
+            # Catch up with changes made outside the editor once, rather
+            # than on every query, and on a worker if the git index has to
+            # be read for that
+            if [index for index in self.indexes if index.git_changes_pending()]:
+                background.start(self.window.id(),
+                                 lambda task: self.refresh_indexes(),
+                                 lambda result: self.ask_for_query())
+            else:
+                self.refresh_indexes()
+                self.ask_for_query()
+            return
+
+        background.start(self.window.id(),
+                         lambda task: [index.build() for index in unbuilt],
+                         lambda result: self.ask_for_query())
+        sublime.status_message('Indexing %s...' % ', '.join(index.root for index in unbuilt))
+
+    def refresh_indexes(self):
+        for index in self.indexes:
+            for name in (self.category and [self.category] or index.built_categories()):
+                index.refresh(name)
+
+    def ask_for_query(self):
+        # The match keys are worked out while the user is typing
+        background.start(self.window.id(),
+                         lambda task: [index.match_key_table(self.category) for index in self.indexes],
+                         lambda result: None)
+        self.window.show_input_panel('Rails class, table or file name:', '', self.search, None, None)
+
+    def search(self, query):
+        with perf_stats.timed(self.__class__.__name__, 'search'):
+            self.files = []
+            for index in self.indexes:
+                self.files.extend(index.search(query, self.category, inflector))
+        if self.files:
+            self.show_panel(self.file_selected)
+        else:
+            sublime.status_message('No Rails files match %s' % query)
+
+    def show_panel(self, on_done):
+        # The files are already ordered by how well they match
+        start_index = len(self.display_root) + 1
+        relative_paths = map(lambda x: x[start_index:] + '  ', self.files)
+        self.window.show_quick_panel(relative_paths, on_done)
+
+
+class GoToRailsConstantCommand(RailsCommandBase):
+    # Jumps to the definition of a class or module, found by reading the Ruby
+    # files rather than by naming conventions, so that STI subclasses,
+    # concerns, service objects and the like are found as well. Goes
+    # straight to the constant under the cursor if it is defined in just one
+    # place, lists its definitions if there are several, and lists all
+    # constants otherwise.
+    def run(self):
+        if not self.setup():
+            return
+        layouts = self.search_layouts()
+        self.display_root = common_directory([root for root, test_type in layouts])
+        self.indexes = []
+        for root, test_type in layouts:
+            index = constant_index.get_index(root, self.cache_dir())
+            index.set_directories([os.path.join(*dir) for dir in self.get_setting('constant_directories') or []],
+                                  self.get_setting('excluded_directories'))
+            self.indexes.append(index)
+
+        unscanned = [index for index in self.indexes if not index.scanned]
+        if unscanned:
+            background.start(self.window.id(),
+                             lambda task: [index.scan() for index in unscanned],
+                             lambda result: self.show_constants())
+            sublime.status_message('Indexing Ruby constants in %s...' % ', '.join(index.root for index in unscanned))
+        else:
+            self.show_constants()
+
+    def show_constants(self):
+        self.definitions = []
+        name = self.text_under_cursor(r'(?:::)?[A-Z]\w*(?:::[A-Z]\w*)*')
+        if name:
+            for index in self.indexes:
+                self.definitions.extend([(constant, os.path.join(index.root, file), line)
+                                         for constant, file, line in index.lookup(name)])
+            if len(self.definitions) == 1:
+                self.definition_selected(0)
+                return
+
+        if not self.definitions:
+            for index in self.indexes:
+                self.definitions.extend([(constant, os.path.join(index.root, file), line)
+                                         for constant, file, line in index.definitions()])
+        start_index = len(self.display_root) + 1
+        items = [[constant, '%s:%d' % (path[start_index:], line)]
+                 for constant, path, line in self.definitions]
+        self.window.show_quick_panel(items, self.definition_selected)
+
+    def definition_selected(self, selected_index):
+        if selected_index != -1:
+            constant, path, line = self.definitions[selected_index]
+            self.open_location(path, line)
+        self.definitions = []
+
+
+class GoToRailsRouteCommand(RailsCommandBase):
+    # Takes the URL helper (edit_admin_user_path), URL (/admin/users/1/edit)
+    # or controller#action under the cursor to the controller action that it
+    # routes to or, with target 'view', to the view template of the action.
+    # Lists the matching routes if there are several, and all routes if
+    # there is nothing under the cursor. Only config/routes.rb is read to
+    # find them, and only again after it has changed.
+    def run(self, target='action'):
+        if not self.setup():
+            return
+        self.target = target
+        index = routes_index.get_index(self.root)
+        with perf_stats.timed(self.__class__.__name__, 'routes'):
+            routes = index.current_routes(inflector)
+        if not routes:
+            sublime.status_message('No routes found in config/routes.rb')
+            return
+
+        self.routes = []
+        text = self.text_under_cursor(r'[\w/:#.?=&%-]+')
+        if text:
+            if text.startswith('/') or '://' in text:
+                self.routes = index.by_url(text, inflector)
+            elif '#' in text:
+                self.routes = index.by_target(text, inflector)
+            else:
+                self.routes = index.by_name(text, inflector)
+        if len(self.routes) == 1:
+            self.route_selected(0)
+            return
+
+        if not self.routes:
+            self.routes = list(routes)
+        items = [[route.name or route.target(), '%s %s  %s' % (route.verb, route.path, route.target())]
+                 for route in self.routes]
+        self.window.show_quick_panel(items, self.route_selected)
+
+    def route_selected(self, selected_index):
+        if selected_index == -1:
+            return
+        route = self.routes[selected_index]
+        if self.target == 'view':
+            self.open_view(route)
+        else:
+            self.open_action(route)
+
+    def open_action(self, route):
+        path = os.path.join(self.root, 'app', 'controllers', *(route.controller + '_controller.rb').split('/'))
+        if not os.path.isfile(path):
+            sublime.status_message('No controller found for %s' % route.target())
+            return
+        self.open_location(path, routes_index.method_line(path, route.action))
+
+    def open_view(self, route):
+        directory = os.path.join(self.root, 'app', 'views', *route.controller.split('/'))
+        self.files = [path for path in list_directory(directory)
+                      if os.path.basename(path).split('.')[0] == route.action]
+        if not self.files:
+            sublime.status_message('No view found for %s' % route.target())
+        elif len(self.files) == 1:
+            self.file_selected(0)
+        else:
+            # E.g. both an HTML and a JSON template
+            start_index = len(self.root) + 1
+            self.window.show_quick_panel([f[start_index:] for f in self.files], self.file_selected)
+
+
+class PartialCommandBase(RailsCommandBase):
+    # Reads the templates of the current root once per session (in the
+    # background, and only those that changed since the index was saved)
+    # before running the command; saved templates keep it up to date after
+    # that
+    def run(self):
+        if not self.setup():
+            return
+        self.index = partial_index.get_index(self.root, self.cache_dir())
+        self.index.set_excluded_directories(self.get_setting('excluded_directories'))
+        self.current_file = None
+        view = self.window.active_view()
+        file_name = view and view.file_name()
+        if file_name and file_name.startswith(os.path.join(self.root, self.VIEW_DIR) + os.sep):
+            self.current_file = file_name[len(self.root) + 1:]
+
+        if self.index.scanned:
+            self.show_templates()
+        else:
+            background.start(self.window.id(),
+                             lambda task: self.index.scan(inflector),
+                             lambda result: self.show_templates())
+            sublime.status_message('Indexing templates in %s...' % self.root)
+
+    def show_locations(self, locations):
+        # Takes (title, file, line number) triples
+        self.locations = locations
+        if len(locations) == 1:
+            self.location_selected(0)
+        else:
+            items = [[title, '%s:%d' % (file, line)] for title, file, line in locations]
+            self.window.show_quick_panel(items, self.location_selected)
+
+    def location_selected(self, selected_index):
+        if selected_index != -1:
+            title, file, line = self.locations[selected_index]
+            self.open_location(os.path.join(self.root, file), line)
+        self.locations = []
+
+
+class GoToRailsPartialCommand(PartialCommandBase):
+    # Jumps from the render call under the cursor to the partial it renders.
+    # Elsewhere in a template, lists the partials that the template renders
+    # and its layout, and outside of templates all partials.
+    def show_templates(self):
+        locations = []
+        if self.current_file:
+            template = partial_index.template_name(self.current_file)
+            call = self.text_under_cursor(r'\brender\b.*')
+            if call:
+                for name, line in partial_index.scan_renders(call, template, inflector):
+                    locations.extend([(name, file, 1) for file in self.index.template_files(name)])
+            if not locations:
+                for name, line in self.index.renders(self.current_file):
+                    locations.extend([(name, file, 1) for file in self.index.template_files(name)])
+                locations.extend([('layout', file, 1) for file in self.index.layout_files(self.current_file)])
+
+        if not locations:
+            templates, callers = self.index.derive()
+            for name in sorted(templates):
+                if name.rpartition('/')[2].startswith('_'):
+                    locations.extend([(name, file, 1) for file in templates[name]])
+        if not locations:
+            sublime.status_message('No partials found')
+            return
+        self.show_locations(locations)
+
+
+class ListRailsPartialCallersCommand(PartialCommandBase):
+    # Lists the templates that render the current partial, at the lines
+    # where they render it
+    def show_templates(self):
+        if not self.current_file or not os.path.basename(self.current_file).startswith('_'):
+            sublime.status_message('The current file is not a partial')
+            return
+        callers = self.index.rendered_by(self.current_file)
+        if not callers:
+            sublime.status_message('No templates render %s' % partial_index.template_name(self.current_file))
+            return
+        self.show_locations([(partial_index.template_name(file), file, line) for file, line in callers])
+
+
+class ShowRailsNavigationStatsCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        print(perf_stats.report())
+        self.window.run_command('show_panel', {'panel': 'console'})
+
+
+def save_all_indexes():
+    file_index.save_all()
+    constant_index.save_all()
+    partial_index.save_all()
+    frecency.save_all()
+
+
+def common_directory(paths):
+    prefix = os.path.commonprefix([path + os.sep for path in paths])
+    return prefix[:prefix.rfind(os.sep)]
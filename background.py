@@ -0,0 +1,132 @@
+import Queue
+import sys
+import threading
+import sublime
+
+# The task currently running for each key (normally a window id)
+_current_tasks = {}
+
+
+class Task(object):
+    def __init__(self, key):
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled
+
+
+def start(key, work, on_done):
+    # Runs work(task) on a worker thread and hands the result to on_done on
+    # the main thread. Starting another task with the same key cancels this
+    # one, so work should check task.is_cancelled() now and then and give up
+    # early if it returns True.
+    cancel(key)
+    task = Task(key)
+    _current_tasks[key] = task
+
+    def run():
+        try:
+            result = work(task)
+        except Exception:
+            if task.is_cancelled():
+                return
+            raise
+        sublime.set_timeout(lambda: finish(task, result, on_done), 0)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return task
+
+
+def cancel(key):
+    task = _current_tasks.pop(key, None)
+    if task:
+        task.cancel()
+
+
+def finish(task, result, on_done):
+    if task.is_cancelled():
+        return
+    if _current_tasks.get(task.key) is task:
+        del _current_tasks[task.key]
+    on_done(result)
+
+
+# Directory walks spend most of their time waiting for the file system
+# (especially on network drives and container mounts), so a few of them can
+# usefully run at the same time
+MAX_WORKERS = 4
+
+# The worker threads that map_parallel hands its calls to, started the first
+# time they are needed and shared by all callers, so that nested calls (a
+# build that walks several directories at once) don't add threads of their own
+_jobs = Queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def start_workers():
+    with _workers_lock:
+        while len(_workers) < MAX_WORKERS:
+            thread = threading.Thread(target=run_jobs)
+            thread.daemon = True
+            thread.start()
+            _workers.append(thread)
+
+
+def run_jobs():
+    while True:
+        _jobs.get()()
+
+
+def map_parallel(function, items):
+    # Returns [function(item) for item in items], calling function on the
+    # shared workers and on the calling thread at the same time. The calling
+    # thread takes part so that every call makes progress even when all the
+    # workers are busy, e.g. with the call that this one is nested in. The
+    # results are always in the order of the items, however the calls happen
+    # to finish. If any call raises, the first exception (in item order) is
+    # raised once all calls are done.
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    remaining = range(len(items))
+    remaining.reverse()
+    finished = [0]
+    lock = threading.Condition()
+
+    def work():
+        while True:
+            with lock:
+                if not remaining:
+                    return
+                i = remaining.pop()
+            try:
+                results[i] = function(items[i])
+            except Exception:
+                errors[i] = sys.exc_info()
+            with lock:
+                finished[0] += 1
+                if finished[0] == len(items):
+                    lock.notify_all()
+
+    start_workers()
+    for i in range(min(MAX_WORKERS, len(items) - 1)):
+        _jobs.put(work)
+    work()
+    with lock:
+        while finished[0] < len(items):
+            lock.wait()
+
+    for error in errors:
+        if error:
+            raise error[0], error[1], error[2]
+    return results
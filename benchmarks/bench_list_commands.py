@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# Headless benchmarks for the SublimeRailsNav list commands.
+#
+# Generates synthetic Rails applications of a few sizes, runs every
+# List*Command against them with stubbed-out sublime and sublime_plugin
+# modules, and reports wall time, file system call counts and peak memory
+# for each one. Results can be saved as a JSON baseline and later runs
+# compared against it:
+#
+#   python benchmarks/bench_list_commands.py --sizes 1000,10000 --output baseline.json
+#   python benchmarks/bench_list_commands.py --sizes 1000,10000 --baseline baseline.json
+#
+# Every measurement runs in a fresh interpreter, so that "cold" really means
+# nothing has been cached and the memory figures are not polluted by earlier
+# runs. Like the plugin itself, this needs Python 2.
+
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    'ListRailsModelsCommand',
+    'ListRailsControllersCommand',
+    'ListRailsViewsCommand',
+    'ListRailsHelpersCommand',
+    'ListRailsFixturesCommand',
+    'ListRailsTestsCommand',
+    'ListRailsJavascriptsCommand',
+    'ListRailsStylesheetsCommand'
+]
+
+# The file that is active when each command runs, so that the related file
+# ranking is exercised as well
+CURRENT_FILES = {
+    'ListRailsModelsCommand': 'app/controllers/widget1s_controller.rb',
+    'ListRailsControllersCommand': 'app/models/widget1.rb',
+    'ListRailsViewsCommand': 'app/controllers/widget1s_controller.rb',
+    'ListRailsHelpersCommand': 'app/controllers/widget1s_controller.rb',
+    'ListRailsFixturesCommand': 'app/models/widget1.rb',
+    'ListRailsTestsCommand': 'app/models/widget1.rb',
+    'ListRailsJavascriptsCommand': 'app/models/widget1.rb',
+    'ListRailsStylesheetsCommand': 'app/models/widget1.rb'
+}
+
+# Share of the files that goes to each part of the synthetic application
+LAYOUT = [
+    ('models', 0.05),
+    ('controllers', 0.03),
+    ('views', 0.25),
+    ('helpers', 0.02),
+    ('fixtures', 0.04),
+    ('specs', 0.16),
+    ('javascripts', 0.30),
+    ('stylesheets', 0.10),
+    ('other', 0.05)
+]
+
+
+# Synthetic applications
+
+def generate_app(directory, size):
+    marker = os.path.join(directory, '.bench_size')
+    if os.path.exists(marker) and open(marker).read() == str(size):
+        return
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+    rand = random.Random(size)
+    counts = dict((part, max(1, int(size * share))) for part, share in LAYOUT)
+    resources = max(1, counts['models'])
+
+    def touch(*parts):
+        path = os.path.join(directory, *parts)
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        open(path, 'w').close()
+
+    for name in ['Gemfile', 'Rakefile']:
+        touch(name)
+    for name in ['app', 'config', 'lib', 'vendor']:
+        touch(name, '.keep')
+    touch('config', 'routes.rb')
+
+    for i in range(counts['models']):
+        touch('app', 'models', 'widget%d.rb' % i)
+    for i in range(counts['controllers']):
+        touch('app', 'controllers', 'widget%ds_controller.rb' % (i % resources))
+    for i in range(counts['helpers']):
+        touch('app', 'helpers', 'widget%ds_helper.rb' % (i % resources))
+    for i in range(counts['fixtures']):
+        touch('test', 'fixtures', 'widget%ds.yml' % (i % resources))
+
+    # Views are nested in namespaces up to four levels deep
+    for i in range(counts['views']):
+        depth = rand.randint(0, 3)
+        namespaces = ['ns%d' % rand.randint(0, 5) for _ in range(depth)]
+        parts = ['app', 'views'] + namespaces + ['widget%ds' % (i % resources)]
+        touch(*(parts + ['view%d.html.erb' % i]))
+
+    spec_dirs = ['models', 'controllers', 'views', 'helpers', 'routing']
+    for i in range(counts['specs']):
+        touch('spec', spec_dirs[i % len(spec_dirs)], 'widget%d_spec.rb' % i)
+
+    # Most of the javascripts are vendored libraries with many small files
+    for i in range(counts['javascripts']):
+        if i % 10 == 0:
+            touch('app', 'assets', 'javascripts', 'script%d.js' % i)
+        else:
+            touch('vendor', 'assets', 'javascripts', 'lib%d' % (i % 50), 'src', 'module%d.js' % i)
+    for i in range(counts['stylesheets']):
+        location = ['app', 'lib', 'vendor'][i % 3]
+        touch(location, 'assets', 'stylesheets', 'style%d.css' % i)
+    for i in range(counts['other']):
+        touch('lib', 'tasks', 'task%d.rake' % i)
+
+    for current_file in set(CURRENT_FILES.values()):
+        touch(*current_file.split('/'))
+
+    f = open(marker, 'w')
+    f.write(str(size))
+    f.close()
+
+
+# Stubs for the editor API
+
+class FakeSettings(object):
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def has(self, key):
+        return key in self.values
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class FakeView(object):
+    def __init__(self, window, file_name):
+        self.window_ = window
+        self.file_name_ = file_name
+        self.settings_ = FakeSettings()
+
+    def id(self):
+        return id(self)
+
+    def file_name(self):
+        return self.file_name_
+
+    def settings(self):
+        return self.settings_
+
+    def window(self):
+        return self.window_
+
+
+class FakeWindow(object):
+    def __init__(self, folder):
+        self.folder = folder
+        self.view = None
+        self.panels = []
+
+    def id(self):
+        return 1
+
+    def folders(self):
+        return [self.folder]
+
+    def active_view(self):
+        return self.view
+
+    def views(self):
+        return [self.view]
+
+    def show_quick_panel(self, items, on_done, *args):
+        self.panels.append(items)
+
+    def run_command(self, *args, **kwargs):
+        pass
+
+    def num_groups(self):
+        return 1
+
+
+class FakeWindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+
+class FakeTextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+
+def install_stubs(packages_path):
+    pending = []
+
+    def load_settings(name):
+        path = os.path.join(PACKAGE_DIR, name)
+        lines = [line for line in open(path) if not line.strip().startswith('//')]
+        return FakeSettings(json.loads(''.join(lines)))
+
+    sublime = types.ModuleType('sublime')
+    sublime.packages_path = lambda: packages_path
+    sublime.error_message = lambda message: sys.stderr.write(message + '\n')
+    sublime.status_message = lambda message: None
+    sublime.set_timeout = lambda callback, delay: pending.append(callback)
+    sublime.load_settings = load_settings
+    sublime.windows = lambda: []
+    sublime.active_window = lambda: None
+
+    sublime_plugin = types.ModuleType('sublime_plugin')
+    sublime_plugin.WindowCommand = FakeWindowCommand
+    sublime_plugin.TextCommand = FakeTextCommand
+    sublime_plugin.ApplicationCommand = type('ApplicationCommand', (object,), {})
+    sublime_plugin.EventListener = type('EventListener', (object,), {})
+
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = sublime_plugin
+    return pending
+
+
+# System call counting
+
+class CallCounter(object):
+    FUNCTIONS = ['stat', 'lstat', 'listdir']
+
+    def __init__(self):
+        self.counts = dict((name, 0) for name in self.FUNCTIONS + ['open'])
+        self.originals = {}
+
+    def install(self):
+        for name in self.FUNCTIONS:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self.counting(name, self.originals[name]))
+        builtins = sys.modules.get('__builtin__') or sys.modules['builtins']
+        self.originals['open'] = builtins.open
+        builtins.open = self.counting('open', builtins.open)
+
+    def counting(self, name, function):
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def reset(self):
+        for name in self.counts:
+            self.counts[name] = 0
+
+    def snapshot(self):
+        return dict(self.counts)
+
+
+# Running a single measurement (in a child process)
+
+def run_command(plugin, window, pending, name):
+    # Runs the command and waits for any background scan to hand its results
+    # back, like the editor would, until the final panel has been shown.
+    # Returns the number of files in that panel and the time it took for the
+    # first panel (possibly with a partial list) to appear.
+    window.panels = []
+    start = time.time()
+    first_panel = None
+    command = getattr(plugin, name)(window)
+    command.run()
+    deadline = start + 600
+    while True:
+        while pending:
+            pending.pop(0)()
+        if window.panels and first_panel is None:
+            first_panel = time.time() - start
+        if window.panels and not plugin.background._current_tasks:
+            break
+        if time.time() > deadline:
+            raise RuntimeError('%s did not finish' % name)
+        time.sleep(0.001)
+    return len(window.panels[-1]), first_panel
+
+
+def measure(app, name, runs):
+    packages_path = tempfile.mkdtemp()
+    try:
+        pending = install_stubs(packages_path)
+        sys.path.insert(0, PACKAGE_DIR)
+        import SublimeRailsNav as plugin
+
+        window = FakeWindow(app)
+        window.view = FakeView(window, os.path.join(app, *CURRENT_FILES[name].split('/')))
+
+        counter = CallCounter()
+        counter.install()
+        results = []
+        for run in range(runs):
+            counter.reset()
+            start = time.time()
+            count, first_panel = run_command(plugin, window, pending, name)
+            elapsed = time.time() - start
+            results.append({'seconds': elapsed, 'first_seconds': first_panel, 'files': count,
+                            'calls': counter.snapshot()})
+    finally:
+        shutil.rmtree(packages_path, ignore_errors=True)
+
+    # The first run starts from nothing, the others reuse whatever the first
+    # one cached
+    warm = results[1:] or results
+    return {
+        'cold_seconds': results[0]['seconds'],
+        'cold_first_seconds': results[0]['first_seconds'],
+        'warm_seconds': min(r['seconds'] for r in warm),
+        'files': results[0]['files'],
+        'cold_calls': results[0]['calls'],
+        'warm_calls': warm[0]['calls'],
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def time_git_listing(app):
+    # Puts the application under git for a moment to time listing the files
+    # of its app directory from .git/index, including the check for
+    # untracked files. Returns None if git isn't installed.
+    try:
+        subprocess.check_call(['git', 'init', '-q', app])
+        subprocess.check_call(['git', 'add', '-A'], cwd=app)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    try:
+        import git_index
+        start = time.time()
+        git_index.list_files(os.path.join(app, 'app'))
+        return time.time() - start
+    finally:
+        shutil.rmtree(os.path.join(app, '.git'))
+
+
+def measure_components(app):
+    # Times the building blocks of the list commands on their own
+    pending = install_stubs(tempfile.mkdtemp())
+    sys.path.insert(0, PACKAGE_DIR)
+    import SublimeRailsNav as plugin
+    from recursive_glob import rglob
+
+    window = FakeWindow(app)
+    window.view = FakeView(window, os.path.join(app, 'app', 'controllers', 'widget1s_controller.rb'))
+    results = {}
+
+    start = time.time()
+    files = rglob(os.path.join(app, 'app'), r'\.(?:rb|erb)$')
+    results['rglob_app_seconds'] = time.time() - start
+
+    git_seconds = time_git_listing(app)
+    if git_seconds is not None:
+        results['git_index_app_seconds'] = git_seconds
+
+    command = plugin.ListRailsViewsCommand(window)
+    start = time.time()
+    command.setup()
+    results['setup_cold_seconds'] = time.time() - start
+    start = time.time()
+    command.setup()
+    results['setup_warm_seconds'] = time.time() - start
+
+    command.paths = [os.path.join('app', 'views')]
+    command.files = [file[len(app) + 1:] for file in files]
+    start = time.time()
+    command.move_related_files_to_top(window.view.file_name())
+    results['rank_seconds'] = time.time() - start
+
+    # The memory held by the index of the whole application, compared with
+    # that of the same files as plain relative path strings
+    index = plugin.get_index(app)
+    index.set_categories(dict((name, ([os.path.join(*dir) for dir in dirs], pattern))
+                              for name, (dirs, pattern) in command.categories().items()))
+    index.build()
+    results['index_kb'] = deep_size([index.files, index.directories]) / 1024.0
+    plain = dict((name, [list(path_list) for path_list in lists]) for name, lists in index.files.items())
+    results['index_as_strings_kb'] = deep_size(plain) / 1024.0
+
+    # Searching by name, once the match keys have been worked out
+    start = time.time()
+    index.match_key_table()
+    results['match_keys_seconds'] = time.time() - start
+    start = time.time()
+    index.search('Widget1sController', None, plugin.inflector)
+    results['search_class_name_seconds'] = time.time() - start
+    start = time.time()
+    index.search('widget2s', None, plugin.inflector)
+    results['search_table_name_seconds'] = time.time() - start
+
+    # 5000 distinct words, none of which has been inflected before, and then
+    # 5000 inflections of the names of 200 resources, as when the names of a
+    # project's files are worked out again and again. The resources fit in
+    # the memo (which holds 1000 words), so only their first inflections miss.
+    words = ['widget%d' % i for i in range(5000)]
+    start = time.time()
+    for word in words:
+        plugin.inflector.singularize(plugin.inflector.pluralize(word))
+    results['inflect_5000_seconds'] = time.time() - start
+    resources = ['gadget%d' % i for i in range(200)]
+    start = time.time()
+    for i in range(5000):
+        word = resources[i % len(resources)]
+        plugin.inflector.singularize(plugin.inflector.pluralize(word))
+    results['inflect_5000_repeat_seconds'] = time.time() - start
+    return results
+
+
+def deep_size(obj, seen=None):
+    # Approximate number of bytes held by obj and everything it refers to,
+    # counting shared objects only once
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            if name != 'index':
+                size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+def run_child(args):
+    # Runs one measurement in a fresh interpreter and returns its results
+    output = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + args,
+                              stdout=subprocess.PIPE).communicate()[0]
+    return json.loads(output.decode('utf-8'))
+
+
+# Reporting
+
+def report(results, baseline):
+    for size in sorted(results, key=int):
+        print('\n%s files' % size)
+        print('  %-30s %10s %10s %10s %8s %10s %10s %10s' % (
+            'command', 'first ms', 'cold ms', 'warm ms', 'files', 'cold I/O', 'warm I/O', 'peak KB'))
+        for name in [name for name in COMMANDS if name in results[size]['commands']]:
+            r = results[size]['commands'][name]
+            line = '  %-30s %10.1f %10.1f %10.1f %8d %10d %10d %10d' % (
+                name, r.get('cold_first_seconds', r['cold_seconds']) * 1000,
+                r['cold_seconds'] * 1000, r['warm_seconds'] * 1000, r['files'],
+                sum(r['cold_calls'].values()), sum(r['warm_calls'].values()), r['peak_rss_kb'])
+            old = baseline.get(size, {}).get('commands', {}).get(name)
+            if old:
+                line += '  (cold x%.2f, warm x%.2f)' % (
+                    ratio(r['cold_seconds'], old['cold_seconds']),
+                    ratio(r['warm_seconds'], old['warm_seconds']))
+            print(line)
+        for key, value in sorted(results[size]['components'].items()):
+            if key.endswith('_kb'):
+                line = '  %-30s %10.1f KB' % (key[:-3], value)
+            else:
+                line = '  %-30s %10.1f ms' % (key.replace('_seconds', ''), value * 1000)
+            old = baseline.get(size, {}).get('components', {}).get(key)
+            if old:
+                line += '  (x%.2f)' % ratio(value, old)
+            print(line)
+
+
+def ratio(new, old):
+    return new / old if old else float('inf')
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help='comma separated numbers of files in the synthetic applications')
+    parser.add_option('--workdir', default=os.path.join(tempfile.gettempdir(), 'sublime_rails_nav_bench'),
+                      help='where to generate the applications (reused between runs)')
+    parser.add_option('--runs', type='int', default=3, help='runs per command, the first one cold')
+    parser.add_option('--commands', default=','.join(COMMANDS), help='comma separated command classes')
+    parser.add_option('--output', help='save the results as JSON to this file')
+    parser.add_option('--baseline', help='compare the results with those saved in this file')
+    parser.add_option('--measure', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--components', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.measure:
+        app, name = options.measure.split(os.pathsep)
+        print(json.dumps(measure(app, name, options.runs)))
+        return
+    if options.components:
+        print(json.dumps(measure_components(options.components)))
+        return
+
+    results = {}
+    for size in options.sizes.split(','):
+        app = os.path.join(options.workdir, 'app%s' % size)
+        sys.stderr.write('Generating %s files in %s...\n' % (size, app))
+        generate_app(app, int(size))
+        results[size] = {'commands': {}, 'components': run_child(['--components', app])}
+        for name in options.commands.split(','):
+            sys.stderr.write('  %s\n' % name)
+            results[size]['commands'][name] = run_child(
+                ['--measure', app + os.pathsep + name, '--runs', str(options.runs)])
+
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+    report(results, baseline)
+
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import json
+import os
+import re
+import threading
+import background
+from file_index import cache_name
+from recursive_glob import iglob
+
+INDEX_VERSION = 1
+
+# One index per Rails root, shared by all commands and windows
+_indexes = {}
+
+# The lines that open a class or module definition, and the lines that may
+# close one. Matching these over the whole file at once is much faster than
+# looking at every line in turn.
+DEFINITION = re.compile(r'^([ \t]*)(?:(?:class|module)[ \t]+([A-Z]\w*(?:::[A-Z]\w*)*)(.*)|end\b)',
+                        re.MULTILINE)
+
+
+def get_index(root, cache_dir=None):
+    index = _indexes.get(root)
+    if index is None:
+        index = ConstantIndex(root, cache_dir)
+        index.load()
+        _indexes[root] = index
+    return index
+
+
+def file_changed(path):
+    for index in indexes_containing(path):
+        index.update_file(path)
+
+
+def file_removed(path):
+    for index in indexes_containing(path):
+        index.remove_file(path)
+
+
+def indexes_containing(path):
+    return [index for index in _indexes.values() if path.startswith(index.root + os.sep)]
+
+
+def save_all():
+    for index in _indexes.values():
+        if index.dirty:
+            index.save()
+
+
+def scan_definitions(source):
+    # Returns (constant, line number) pairs for the classes and modules
+    # defined in a Ruby source, with their full names (Admin::UsersController
+    # for a class UsersController nested in a module Admin). Nesting is
+    # judged by indentation, which is good enough for code that follows the
+    # usual style.
+    definitions = []
+    nesting = []
+    line = 1
+    position = 0
+    for match in DEFINITION.finditer(source):
+        line += source.count('\n', position, match.start())
+        position = match.start()
+        indent = len(match.group(1))
+        name = match.group(2)
+        if name is None:
+            if nesting and nesting[-1][0] == indent:
+                nesting.pop()
+            continue
+
+        while nesting and nesting[-1][0] >= indent:
+            nesting.pop()
+        full_name = '::'.join([outer for i, outer in nesting] + [name])
+        definitions.append((full_name, line))
+        if not re.search(r'\bend\s*$', match.group(3)):
+            # Not a one-liner like class Error < StandardError; end
+            nesting.append((indent, name))
+    return definitions
+
+
+class ConstantIndex(object):
+    def __init__(self, root, cache_dir=None):
+        self.root = root
+        self.cache_dir = cache_dir
+        # The directories (relative to the root) whose Ruby files are read
+        self.directories = []
+        # Glob patterns for the names of directories that are never walked
+        self.excluded_directories = []
+        # Maps each Ruby file (relative to the root) to its mtime and the
+        # (constant, line number) pairs defined in it
+        self.files = {}
+        # Sorted (constant, file, line number) triples, derived from
+        # self.files when they are first asked for after a change
+        self.constants = None
+        # Whether the files have been checked for changes since the editor
+        # was started; until then, what was loaded from disk may be stale
+        self.scanned = False
+        # Bumped when the directories change, so that a scan that was walking
+        # the old ones knows to start over
+        self.generation = 0
+        self.dirty = False
+        # Scans run on a worker thread while the main thread reads the
+        # constants or updates them for saved files
+        self.lock = threading.RLock()
+
+    def set_directories(self, directories, excluded_directories):
+        directories = list(directories)
+        excluded_directories = list(excluded_directories or [])
+        with self.lock:
+            if directories == self.directories and excluded_directories == self.excluded_directories:
+                return
+            self.directories = directories
+            self.excluded_directories = excluded_directories
+            # The constants found so far may come from files that are no
+            # longer read, and miss those of the new directories
+            self.files = dict((file, entry) for file, entry in self.files.items()
+                              if self.is_indexed(file))
+            self.constants = None
+            self.scanned = False
+            self.generation += 1
+
+    def scan(self):
+        # Lists the Ruby files and reads only those that are new or have
+        # changed since they were last read
+        while True:
+            with self.lock:
+                known = dict(self.files)
+                directories = self.directories
+                generation = self.generation
+            files = {}
+            for found in background.map_parallel(lambda directory: self.scan_directory(directory, known),
+                                                 directories):
+                files.update(found)
+            with self.lock:
+                if generation != self.generation:
+                    # The directories changed while we were reading them
+                    continue
+                self.files = files
+                self.constants = None
+                self.scanned = True
+                self.save()
+                return
+
+    def scan_directory(self, directory, known):
+        files = {}
+        start_index = len(self.root) + 1
+        for path in iglob(os.path.join(self.root, directory), r'\.rb$', self.excluded_directories):
+            file = path[start_index:]
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entry = known.get(file)
+            if entry is None or entry[0] != mtime:
+                entry = [mtime, self.read_definitions(path)]
+            files[file] = entry
+        return files
+
+    def read_definitions(self, path):
+        try:
+            f = open(path)
+            try:
+                return scan_definitions(f.read())
+            finally:
+                f.close()
+        except IOError:
+            return []
+
+    def update_file(self, path):
+        file = self.relative_path(path)
+        if not file.endswith('.rb') or not self.is_indexed(file) or not os.path.isfile(path):
+            return
+        entry = [os.path.getmtime(path), self.read_definitions(path)]
+        with self.lock:
+            self.files[file] = entry
+            self.constants = None
+            self.dirty = True
+
+    def remove_file(self, path):
+        file = self.relative_path(path)
+        with self.lock:
+            if file in self.files:
+                del self.files[file]
+                self.constants = None
+                self.dirty = True
+
+    def is_indexed(self, file):
+        for directory in self.directories:
+            if file.startswith(directory + os.sep):
+                return True
+        return False
+
+    def definitions(self):
+        with self.lock:
+            if self.constants is None:
+                constants = []
+                for file, (mtime, definitions) in self.files.items():
+                    for name, line in definitions:
+                        constants.append((name, file, line))
+                constants.sort()
+                self.constants = constants
+            return self.constants
+
+    def lookup(self, name):
+        # Returns the definitions of a constant, by its full name or, failing
+        # that, by the last part of it (UsersController for
+        # Admin::UsersController)
+        name = name.strip(':')
+        definitions = self.definitions()
+        found = [d for d in definitions if d[0] == name]
+        if not found:
+            found = [d for d in definitions if d[0].endswith('::' + name)]
+        return found
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.root)
+
+    def cache_file(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, cache_name(self.root) + '.constants.json')
+
+    def load(self):
+        cache_file = self.cache_file()
+        if not cache_file or not os.path.exists(cache_file):
+            return
+        try:
+            f = open(cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # A missing or corrupt cache just means reading all files again
+            return
+        if data.get('version') == INDEX_VERSION and data.get('root') == self.root:
+            self.files = data['files']
+
+    def save(self):
+        cache_file = self.cache_file()
+        if not cache_file:
+            return
+        with self.lock:
+            self.write(cache_file)
+
+    def write(self, cache_file):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(cache_file, 'w')
+            try:
+                json.dump({'version': INDEX_VERSION, 'root': self.root, 'files': self.files}, f)
+            finally:
+                f.close()
+            self.dirty = False
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,703 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from array import array
+from itertools import izip
+import background
+import git_index
+from match_keys import MatchKeyTable
+from recursive_glob import iglob, compile_prune
+
+INDEX_VERSION = 7
+
+# One index per Rails root, shared by all commands and windows
+_indexes = {}
+
+
+def get_index(root, cache_dir=None):
+    index = _indexes.get(root)
+    if index is None:
+        index = FileIndex(root, cache_dir)
+        index.load()
+        _indexes[root] = index
+    return index
+
+
+def cache_name(root):
+    # The name of the cache files of a root. The editor gives roots as
+    # unicode, but they may also be byte strings in any encoding, which md5
+    # takes as they are.
+    if isinstance(root, unicode):
+        root = root.encode('utf-8')
+    return hashlib.md5(root).hexdigest()
+
+
+def file_added(path):
+    for index in indexes_containing(path):
+        index.add_file(path)
+
+
+def file_removed(path):
+    for index in indexes_containing(path):
+        index.remove_file(path)
+
+
+def indexes_containing(path):
+    return [index for index in _indexes.values() if path.startswith(index.root + os.sep)]
+
+
+def indexes_below(directory):
+    # The indexes of a Rails root and of the engines inside it
+    return [index for index in _indexes.values()
+            if index.root == directory or index.root.startswith(directory + os.sep)]
+
+
+def save_all():
+    for index in _indexes.values():
+        if index.dirty:
+            index.save()
+
+
+class FileIndex(object):
+    def __init__(self, root, cache_dir=None):
+        self.root = root
+        self.cache_dir = cache_dir
+        # Maps each category of files (models, views, ...) to a dict with the
+        # directories it is found in (relative to the Rails root) and the
+        # pattern that the file names must match
+        self.categories = {}
+        # Maps each category that has been built to one PathList per
+        # directory of the category, holding the files found there in the
+        # order in which the walk found them
+        self.files = {}
+        # The directories (relative to the root) that the files in the path
+        # lists are in, and the position of each in that table, so that every
+        # directory is only stored once however many files it holds
+        self.directories = []
+        self.directory_ids = {}
+        # The modification times of every directory that the walk went
+        # through, which change whenever a file or directory is added to or
+        # removed from them. Changes made from within the editor are patched
+        # into the lists directly, so these only need to catch changes made
+        # by other programs.
+        self.mtimes = {}
+        # Glob patterns for the names of directories that are never walked
+        self.excluded_directories = []
+        # Whether files are listed from the git index rather than by walking
+        self.use_git_index = True
+        # The snapshot of the git index that the lists are up to date with,
+        # and the state of HEAD and the index when it was taken. A checkout
+        # or rebase changes the state; the lists are then patched with the
+        # difference between the two snapshots. Only the state is saved, so
+        # after a restart a changed state has the lists compared with the
+        # index itself instead.
+        self.git_snapshot = None
+        self.git_state = None
+        self.dirty = False
+        # Bumped whenever the lists and the directory table are thrown away,
+        # so that a build that was walking at the time knows to start over
+        self.generation = 0
+        # Bumped on every change to the lists, so that anything derived from
+        # them knows when to derive it again
+        self.version = 0
+        # Maps a category (or None for all of them) to the MatchKeyTable
+        # built for searching it
+        self.match_key_tables = {}
+        # Builds run on a worker thread while the main thread looks up
+        # cached lists or patches them from editor events. Directory walks
+        # happen outside the lock; only reading and storing results is
+        # serialized.
+        self.lock = threading.RLock()
+        # Only one build runs at a time, so that commands issued in quick
+        # succession wait for the same traversal instead of starting their own
+        self.build_lock = threading.Lock()
+        self.patterns = {}
+
+    def set_excluded_directories(self, excluded_directories):
+        excluded_directories = list(excluded_directories or [])
+        with self.lock:
+            if excluded_directories != self.excluded_directories:
+                # What has been scanned so far was scanned with different
+                # exclusions, so start over
+                self.excluded_directories = excluded_directories
+                self.files = {}
+                self.mtimes = {}
+                self.directories = []
+                self.directory_ids = {}
+                self.dirty = True
+                self.version += 1
+                self.generation += 1
+
+    def set_categories(self, categories):
+        # Takes a dict mapping category names to (directories, file pattern)
+        # pairs. Categories whose definition has changed since they were
+        # built will be built again.
+        with self.lock:
+            for name, (directories, file_pattern) in categories.items():
+                definition = {'directories': list(directories), 'pattern': file_pattern}
+                if self.categories.get(name) != definition:
+                    self.categories[name] = definition
+                    self.files.pop(name, None)
+                    self.dirty = True
+                    self.version += 1
+                if name not in self.patterns or self.patterns[name].pattern != file_pattern:
+                    self.patterns[name] = re.compile(file_pattern)
+
+    def is_built(self, category):
+        with self.lock:
+            return category in self.files
+
+    def find(self, category, prefix=None):
+        # Returns the files in a category that has been built, after checking
+        # that nothing has changed behind our back. Their paths are relative
+        # to the root and joined to prefix, the root itself by default.
+        self.refresh(category)
+        return self.listed_files(category, prefix)
+
+    def listed_files(self, category, prefix=None):
+        # The files of a category as they were last listed, without looking
+        # at the disk
+        if prefix is None:
+            prefix = self.root
+        with self.lock:
+            files = []
+            for path_list in self.files[category]:
+                files.extend(path_list.paths(prefix))
+            return files
+
+    def search(self, query, category=None, inflector=None):
+        # Returns the absolute paths of the files in the given category (or
+        # in all built categories) whose names match query; see match_keys.
+        # Unlike find, this doesn't check the disk for changes, so that it
+        # stays fast enough to run on every query; call refresh beforehand.
+        table = self.match_key_table(category)
+        return [os.path.join(self.root, file) for file in table.search(query, inflector)]
+
+    def match_key_table(self, category=None):
+        categories = category and [category] or self.built_categories()
+        with self.lock:
+            table = self.match_key_tables.get(category)
+            if table is None or table.version != self.version:
+                entries = []
+                seen = set()
+                for name in sorted(categories):
+                    for directory, path_list in zip(self.categories[name]['directories'],
+                                                    self.files[name]):
+                        for file in path_list:
+                            # Some files are in more than one category
+                            if file not in seen:
+                                seen.add(file)
+                                entries.append((directory, file))
+                table = MatchKeyTable(entries, self.version)
+                self.match_key_tables[category] = table
+            return table
+
+    def built_categories(self):
+        with self.lock:
+            return [name for name in self.categories if name in self.files]
+
+    def build(self, categories=None, on_found=None):
+        # Finds the files of all the given categories (by default all those
+        # that haven't been built yet) in a single traversal. If on_found is
+        # given, it is called with the category and relative path of each
+        # file as soon as it is found, from whichever thread walks it.
+        with self.build_lock:
+            while True:
+                with self.lock:
+                    self.apply_git_changes()
+                    names = categories
+                    if names is None:
+                        names = self.categories.keys()
+                    definitions = dict((name, self.categories[name]) for name in names
+                                       if name not in self.files)
+                    generation = self.generation
+                if not definitions:
+                    return
+
+                files, mtimes = self.walk(definitions, on_found=on_found)
+
+                with self.lock:
+                    if self.generation != generation:
+                        # The lists were thrown away while we were walking,
+                        # along with the directory table that our files
+                        # point into, so walk again with the new settings
+                        continue
+                    for name, definition in definitions.items():
+                        # Skip categories that were redefined while we were walking
+                        if self.categories.get(name) == definition:
+                            self.files[name] = files[name]
+                    self.mtimes.update(mtimes)
+                    self.version += 1
+                    self.save()
+                    return
+
+    def walk(self, definitions, subdirectory=None, on_found=None):
+        # Walks the directories of the given categories and classifies each
+        # file into all the categories it belongs to. Every file is visited
+        # only once, even where directories are nested in each other (e.g.
+        # test and test/fixtures). With a subdirectory, only that part of the
+        # tree is walked. Returns the files and the mtimes of the directories
+        # that were walked.
+        targets = []
+        files = {}
+        for name, definition in definitions.items():
+            files[name] = []
+            for directory in definition['directories']:
+                files[name].append(PathList(self))
+                targets.append((name, len(files[name]) - 1, directory))
+
+        if subdirectory is None:
+            tops = [directory for name, i, directory in targets]
+        else:
+            tops = [subdirectory]
+        tops = [top for top in sorted(set(tops))
+                if not [other for other in tops if other != top and contains(other, top)]]
+
+        # The directories are walked concurrently, but the results are merged
+        # in a fixed order, so the lists come out the same every time
+        walks = [(top, [(name, i, directory) for name, i, directory in targets
+                        if contains(directory, top) or contains(top, directory)], on_found)
+                 for top in tops]
+        mtimes = {}
+        for found, walked in background.map_parallel(self.walk_directory, walks):
+            for (name, i), directory_files in found:
+                files[name][i].extend(directory_files)
+            mtimes.update(walked)
+        return files, mtimes
+
+    def walk_directory(self, walk):
+        # Walks one directory and returns ((category, directory index), files)
+        # pairs for the category directories in it, along with the mtimes of
+        # the directories it went through. Each mtime is taken before the
+        # directory is read, so that a file added while it is being read
+        # shows up as a change the next time.
+        top, targets, on_found = walk
+        found = [((name, i), PathList(self)) for name, i, directory in targets]
+        start_index = len(self.root) + 1
+        mtimes = {}
+
+        def walked(path):
+            directory = path[start_index:]
+            mtimes[directory] = self.mtime(directory)
+
+        last_directory = None
+        # Keep a single copy of each distinct file name (index.html.erb,
+        # _form.html.erb and the like occur over and over)
+        names = {}
+        for path in self.list_files(top, walked):
+            file = path[start_index:]
+            separator = file.rfind(os.sep)
+            directory = file[:separator]
+            basename = file[separator + 1:]
+            if directory != last_directory:
+                # The walk yields all files of a directory in a row
+                directory_id = self.directory_id(directory)
+                last_directory = directory
+            basename = names.setdefault(basename, basename)
+            for (name, i, category_directory), (key, path_list) in zip(targets, found):
+                if (file.startswith(category_directory + os.sep) and
+                        self.patterns[name].search(basename)):
+                    path_list.add(directory_id, basename)
+                    if on_found:
+                        on_found(name, file)
+        return found, mtimes
+
+    def list_files(self, top, on_directory=None):
+        # The files below a directory, from the git index if the root is in
+        # a git work tree (which also leaves out ignored files), or else by
+        # walking the directory
+        directory = os.path.join(self.root, top)
+        files = None
+        if self.use_git_index:
+            files = git_index.list_files(directory, self.excluded_directories, on_directory)
+        if files is None:
+            files = iglob(directory, '', self.excluded_directories, on_directory)
+        return files
+
+    def directory_id(self, directory):
+        with self.lock:
+            directory_id = self.directory_ids.get(directory)
+            if directory_id is None:
+                directory_id = self.directory_ids[directory] = len(self.directories)
+                self.directories.append(directory)
+            return directory_id
+
+    def git_changes_pending(self):
+        # Whether the git index has to be read to bring the lists up to
+        # date, found with a few stats. Reading and comparing the index can
+        # take a while in a large repository, so callers on the main thread
+        # leave the refresh to a worker when this is true.
+        if not self.use_git_index:
+            return False
+        location = git_index.work_tree(self.root)
+        if not location:
+            return False
+        return self.git_snapshot is None or git_index.state(location[1]) != self.git_state
+
+    def refresh(self, category):
+        if self.use_git_index:
+            # Reads a changed index before taking the lock, so that the
+            # lists can still be read by others in the meantime
+            git_index.snapshot(self.root)
+        with self.lock:
+            self.apply_git_changes()
+            # One stat per directory and none per file
+            directories = self.categories[category]['directories']
+            changed = [watched for watched, mtime in self.mtimes.items()
+                       if [directory for directory in directories if contains(directory, watched)]
+                       and self.mtime(watched) != mtime]
+            if not changed:
+                return
+
+            # Only rescan the directories that have changed (along with what
+            # is below them, where new subdirectories may be) and splice the
+            # results into the existing lists of every category
+            rescanned = []
+            for directory in sorted(changed):
+                if not [other for other in rescanned if contains(other, directory)]:
+                    self.rescan(directory)
+                    rescanned.append(directory)
+            self.save()
+
+    def apply_git_changes(self):
+        # After a checkout, rebase or the like, adds and removes just the
+        # files that were added to or removed from the git index, rather
+        # than rescanning every directory they are in. Files git doesn't
+        # track are not affected by any of those. Applying the same changes
+        # twice does no harm, so a build that walked a newer index than the
+        # one the other lists are up to date with ends up correct as well.
+        if not self.use_git_index:
+            return
+        old = self.git_snapshot
+        if old is not None and git_index.state(old.git_dir) == self.git_state:
+            return
+        new = git_index.snapshot(self.root)
+        if new is None:
+            self.git_snapshot = self.git_state = None
+            return
+        old_state = self.git_state
+        self.git_state = git_index.state(new.git_dir)
+        self.git_snapshot = new
+        if not self.files:
+            return
+        if self.git_state != old_state:
+            # Save the new state, so that it isn't compared again after a
+            # restart
+            self.dirty = True
+        if new is old:
+            return
+        if old is None:
+            if self.git_state == old_state:
+                # Loaded from disk, and nothing has been checked out since
+                return
+            added, removed = self.git_differences(new)
+        else:
+            added, removed = new.changes(old, self.root)
+            start_index = len(self.root) + 1
+            added = [path[start_index:] for path in added]
+            removed = [path[start_index:] for path in removed]
+
+        if removed:
+            removed_pairs = set()
+            for file in removed:
+                directory, name = os.path.split(file)
+                if directory in self.directory_ids:
+                    removed_pairs.add((self.directory_ids[directory], name))
+            for name, lists in self.files.items():
+                self.files[name] = [path_list.without_files(removed_pairs) for path_list in lists]
+        if added:
+            pruned = compile_prune(self.excluded_directories)
+            for name, lists in self.files.items():
+                pattern = self.patterns[name]
+                for i, directory in enumerate(self.categories[name]['directories']):
+                    found = [file for file in added
+                             if file.startswith(directory + os.sep) and pattern.search(os.path.basename(file))
+                             and not self.is_excluded(file, directory, pruned)]
+                    if found:
+                        listed = set(lists[i])
+                        for file in found:
+                            if file not in listed:
+                                lists[i].append(file)
+
+        # The directories that were changed are up to date now, so the
+        # refresh by mtimes should not rescan them
+        touched = set()
+        for file in added + removed:
+            directory = os.path.dirname(file)
+            while directory and directory not in touched:
+                touched.add(directory)
+                directory = os.path.dirname(directory)
+        category_directories = self.category_directories()
+        pruned = compile_prune(self.excluded_directories)
+        for directory in touched:
+            if not [other for other in category_directories
+                    if contains(other, directory) and not self.is_excluded(directory + os.sep, other, pruned)]:
+                continue
+            mtime = self.mtime(directory)
+            if mtime is None and directory not in category_directories:
+                self.mtimes.pop(directory, None)
+            else:
+                self.mtimes[directory] = mtime
+        if added or removed:
+            self.dirty = True
+            self.version += 1
+
+    def git_differences(self, snapshot):
+        # The lists were loaded from disk and the index has changed since
+        # they were saved, but the snapshot they were made with is gone.
+        # Compares them with the index instead: tracked files that aren't
+        # listed have been added, and listed files that aren't tracked have
+        # been removed, unless they are untracked files that are still there.
+        start_index = len(self.root) + 1
+        tracked = set([path[start_index:]
+                       for path in map(snapshot.absolute_path, snapshot.files_below(snapshot.prefix(self.root)))])
+        listed = set()
+        for lists in self.files.values():
+            for path_list in lists:
+                listed.update(path_list)
+        added = sorted(tracked - listed)
+        removed = [file for file in sorted(listed - tracked)
+                   if not os.path.exists(os.path.join(self.root, file))]
+        return added, removed
+
+    def is_excluded(self, file, directory, pruned):
+        # Whether a file in a category directory is below one of the
+        # excluded directories, which the walk would not have gone into
+        if not pruned:
+            return False
+        for part in file[len(directory) + 1:].split(os.sep)[:-1]:
+            if pruned.match(part):
+                return True
+        return False
+
+    def rescan(self, subdirectory):
+        definitions = dict((name, definition) for name, definition in self.categories.items()
+                           if name in self.files)
+        files, mtimes = self.walk(definitions, subdirectory)
+        for name, definition in definitions.items():
+            for i, directory in enumerate(definition['directories']):
+                if contains(directory, subdirectory):
+                    scope = subdirectory
+                elif contains(subdirectory, directory):
+                    scope = directory
+                else:
+                    continue
+                path_list = self.files[name][i].without_directory(scope)
+                path_list.extend(files[name][i])
+                self.files[name][i] = path_list
+        self.version += 1
+
+        # Watch the directories that the rescan went through, and no longer
+        # those that are gone
+        for watched in self.mtimes.keys():
+            if contains(subdirectory, watched):
+                del self.mtimes[watched]
+        self.mtimes.update(mtimes)
+
+    def category_directories(self):
+        directories = []
+        for definition in self.categories.values():
+            directories.extend(definition['directories'])
+        return directories
+
+    def mtime(self, directory):
+        try:
+            return os.path.getmtime(os.path.join(self.root, directory))
+        except OSError:
+            return None
+
+    def add_file(self, path):
+        if not os.path.isfile(path):
+            return
+        file = self.relative_path(path)
+        basename = os.path.basename(file)
+        with self.lock:
+            pruned = compile_prune(self.excluded_directories)
+            for name, lists in self.files.items():
+                if not self.patterns[name].search(basename):
+                    continue
+                for i, directory in enumerate(self.categories[name]['directories']):
+                    if file.startswith(directory + os.sep) and file not in lists[i] and \
+                            not self.is_excluded(file, directory, pruned):
+                        lists[i].append(file)
+                        self.dirty = True
+                        self.version += 1
+
+    def remove_file(self, path):
+        file = self.relative_path(path)
+        with self.lock:
+            for lists in self.files.values():
+                for directory_files in lists:
+                    if file in directory_files:
+                        directory_files.remove(file)
+                        self.dirty = True
+                        self.version += 1
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.root)
+
+    def cache_file(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, cache_name(self.root) + '.json')
+
+    def load(self):
+        cache_file = self.cache_file()
+        if not cache_file or not os.path.exists(cache_file):
+            return
+        try:
+            f = open(cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # A missing or corrupt cache just means a cold scan
+            return
+        if data.get('version') == INDEX_VERSION and self.native(data.get('root')) == self.root:
+            native = self.native
+            self.categories = {}
+            for name, definition in data['categories'].items():
+                self.categories[native(name)] = {'directories': map(native, definition['directories']),
+                                                 'pattern': definition['pattern']}
+            self.directories = map(native, data['directories'])
+            self.directory_ids = dict((directory, i) for i, directory in enumerate(self.directories))
+            self.files = {}
+            shared_names = {}
+            for name, lists in data['files'].items():
+                name = native(name)
+                self.files[name] = []
+                for directory_ids, names in lists:
+                    names = [shared_names.setdefault(n, n) for n in map(native, names)]
+                    self.files[name].append(PathList(self, directory_ids, names))
+            self.mtimes = dict((native(directory), mtime) for directory, mtime in data['mtimes'].items())
+            self.excluded_directories = map(native, data['excluded_directories'])
+            self.git_state = data.get('git_state')
+            for name, definition in self.categories.items():
+                self.patterns[name] = re.compile(definition['pattern'])
+
+    def native(self, value):
+        # json gives back unicode strings, while the walker gives strings of
+        # the same type as the root, and the two must not be mixed in the
+        # lists (joining a non-ASCII byte string to unicode fails)
+        if isinstance(value, unicode) and not isinstance(self.root, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def save(self):
+        cache_file = self.cache_file()
+        if not cache_file:
+            return
+        with self.lock:
+            self.write(cache_file)
+
+    def write(self, cache_file):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(cache_file, 'w')
+            try:
+                json.dump({'version': INDEX_VERSION, 'root': self.root,
+                           'categories': self.categories, 'directories': self.directories,
+                           'files': dict((name, [path_list.to_json() for path_list in lists])
+                                         for name, lists in self.files.items()),
+                           'mtimes': self.mtimes,
+                           'excluded_directories': self.excluded_directories,
+                           'git_state': self.git_state}, f)
+            finally:
+                f.close()
+            self.dirty = False
+        except (IOError, OSError):
+            pass
+
+
+def contains(directory, path):
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class PathList(object):
+    # A list of files relative to the root of an index, stored compactly: for
+    # each file, the position of its directory in the directory table of the
+    # index and its name, with one copy of each distinct name per walk. Paths
+    # are only put together when asked for.
+    __slots__ = ('index', 'directory_ids', 'names')
+
+    def __init__(self, index, directory_ids=(), names=()):
+        self.index = index
+        self.directory_ids = array('i', directory_ids)
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        directories = self.index.directories
+        for directory_id, name in izip(self.directory_ids, self.names):
+            yield os.path.join(directories[directory_id], name)
+
+    def __contains__(self, file):
+        return self.position(file) != -1
+
+    def add(self, directory_id, name):
+        self.directory_ids.append(directory_id)
+        self.names.append(name)
+
+    def append(self, file):
+        directory, name = os.path.split(file)
+        self.add(self.index.directory_id(directory), name)
+
+    def extend(self, other):
+        self.directory_ids.extend(other.directory_ids)
+        self.names.extend(other.names)
+
+    def remove(self, file):
+        position = self.position(file)
+        if position != -1:
+            del self.directory_ids[position]
+            del self.names[position]
+
+    def position(self, file):
+        directory, name = os.path.split(file)
+        directory_id = self.index.directory_ids.get(directory)
+        if directory_id is None:
+            return -1
+        for position, (other_id, other_name) in enumerate(izip(self.directory_ids, self.names)):
+            if other_id == directory_id and other_name == name:
+                return position
+        return -1
+
+    def without_files(self, pairs):
+        # Returns a copy without the files given as (directory id, name)
+        # pairs
+        path_list = PathList(self.index)
+        for directory_id, name in izip(self.directory_ids, self.names):
+            if (directory_id, name) not in pairs:
+                path_list.add(directory_id, name)
+        return path_list
+
+    def without_directory(self, directory):
+        # Returns a copy without the files below the given directory
+        directories = self.index.directories
+        excluded = set([i for i in set(self.directory_ids) if contains(directory, directories[i])])
+        path_list = PathList(self.index)
+        for directory_id, name in izip(self.directory_ids, self.names):
+            if directory_id not in excluded:
+                path_list.add(directory_id, name)
+        return path_list
+
+    def paths(self, prefix=''):
+        # The paths joined to prefix, putting each directory together once
+        joined = {}
+        directories = self.index.directories
+        paths = []
+        for directory_id, name in izip(self.directory_ids, self.names):
+            directory = joined.get(directory_id)
+            if directory is None:
+                directory = joined[directory_id] = os.path.join(prefix, directories[directory_id])
+            paths.append(os.path.join(directory, name))
+        return paths
+
+    def to_json(self):
+        return [self.directory_ids.tolist(), self.names]
@@ -0,0 +1,116 @@
+import json
+import os
+import time
+from file_index import cache_name
+
+# Remembers which files are opened from each list, so that the files opened
+# often and recently can be put first. Every file has a score that goes up
+# by one each time it is opened and halves every HALF_LIFE seconds in
+# between; it is stored together with the time it was last brought up to
+# date, so that recording a selection doesn't touch any other file.
+
+INDEX_VERSION = 1
+
+HALF_LIFE = 7 * 24 * 3600
+# The number of files remembered per list. When there are more, the ones
+# with the lowest scores are forgotten, a quarter of them at a time.
+MAX_ENTRIES = 200
+
+# One store per Rails root, shared by all commands and windows
+_stores = {}
+
+
+def get_store(root, cache_dir=None):
+    store = _stores.get(root)
+    if store is None:
+        store = FrecencyStore(root, cache_dir)
+        _stores[root] = store
+    return store
+
+
+def save_all():
+    for store in _stores.values():
+        if store.dirty:
+            store.save()
+
+
+def decayed(score, since, now):
+    return score * 0.5 ** (max(now - since, 0) / float(HALF_LIFE))
+
+
+class FrecencyStore(object):
+    def __init__(self, root, cache_dir=None):
+        self.root = root
+        self.cache_dir = cache_dir
+        # Maps each category to a dict from files (relative to the root) to
+        # their [score, time] pairs. Read from disk when first needed, so
+        # that commands that never rank by it don't pay for it.
+        self.categories = None
+        self.dirty = False
+
+    def category_entries(self, category):
+        if self.categories is None:
+            self.categories = self.load()
+        return self.categories.setdefault(category, {})
+
+    def record(self, category, file, now=None):
+        if now is None:
+            now = time.time()
+        entries = self.category_entries(category)
+        entry = entries.get(file)
+        score = decayed(entry[0], entry[1], now) if entry else 0.0
+        entries[file] = [round(score + 1, 4), int(now)]
+        if len(entries) > MAX_ENTRIES:
+            self.evict(entries, now)
+        self.dirty = True
+
+    def evict(self, entries, now):
+        ranked = sorted(entries.items(), key=lambda item: -decayed(item[1][0], item[1][1], now))
+        for file, entry in ranked[MAX_ENTRIES * 3 / 4:]:
+            del entries[file]
+
+    def scores(self, category, prefix='', now=None):
+        # Maps the files opened from a list, with their paths relative to the
+        # root joined to prefix, to their current scores
+        if now is None:
+            now = time.time()
+        return dict((os.path.join(prefix, file), decayed(score, since, now))
+                    for file, (score, since) in self.category_entries(category).items())
+
+    def cache_file(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, cache_name(self.root) + '.frecency.json')
+
+    def load(self):
+        cache_file = self.cache_file()
+        if not cache_file or not os.path.exists(cache_file):
+            return {}
+        try:
+            f = open(cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # A missing or corrupt file just means starting from scratch
+            return {}
+        if data.get('version') == INDEX_VERSION and data.get('root') == self.root:
+            return data['categories']
+        return {}
+
+    def save(self):
+        cache_file = self.cache_file()
+        if not cache_file or self.categories is None:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(cache_file, 'w')
+            try:
+                json.dump({'version': INDEX_VERSION, 'root': self.root, 'categories': self.categories}, f)
+            finally:
+                f.close()
+            self.dirty = False
+        except (IOError, OSError):
+            pass
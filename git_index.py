@@ -0,0 +1,346 @@
+import bisect
+import fnmatch
+import os
+import re
+import struct
+import threading
+from recursive_glob import iglob, compile_prune
+
+# Lists the files of a git work tree from its .git/index instead of walking
+# the directories: one read of a single file rather than a stat of every
+# entry, and files ignored by git (tmp, public/packs, ...) are left out for
+# free. Files that git doesn't know about yet are found by listing each
+# directory with tracked files in it and only looking closer at the names
+# that git doesn't know.
+
+# Maps each git directory, and whether its paths are unicode, to the snapshot
+# last read from its index
+_snapshots = {}
+# Maps directories (and whether they are unicode, since an ASCII byte string
+# and its unicode equivalent are the same key) to the work tree and git
+# directory they are in (or None), since every refresh of the lists asks
+_work_trees = {}
+_lock = threading.Lock()
+
+# File modes of index entries that are not files in the work tree
+GITLINK_MODE = 0160000
+DIRECTORY_MODE = 0040000
+
+
+def work_tree(directory):
+    # Returns the work tree and git directory of the repository that the
+    # directory is in, or None if it isn't in one
+    key = (directory, isinstance(directory, unicode))
+    if key not in _work_trees:
+        _work_trees[key] = find_work_tree(directory)
+    return _work_trees[key]
+
+
+def find_work_tree(directory):
+    path = directory
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules point to their git directory
+            git_dir = read_git_file(dot_git)
+            if git_dir and isinstance(path, unicode):
+                git_dir = git_dir.decode('utf-8', 'replace')
+            return git_dir and (path, os.path.join(path, git_dir))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def read_git_file(dot_git):
+    lines = read_lines(dot_git)
+    if lines and lines[0].startswith('gitdir:'):
+        return lines[0][len('gitdir:'):].strip()
+    return None
+
+
+def read_lines(path):
+    try:
+        f = open(path)
+        try:
+            return f.read().splitlines()
+        finally:
+            f.close()
+    except IOError:
+        return []
+
+
+def snapshot(directory):
+    # The snapshot of the index of the repository that the directory is in,
+    # read again only when the index has changed, or None if the directory
+    # isn't in a repository or its index can't be read
+    location = work_tree(directory)
+    if not location:
+        return None
+    path, git_dir = location
+    index_file = os.path.join(git_dir, 'index')
+    try:
+        stat = os.stat(index_file)
+    except OSError:
+        return None
+    # The index holds UTF-8 byte strings, but the editor gives unicode paths,
+    # and the names listed in a unicode directory only compare equal to
+    # tracked names of the same type
+    key = (git_dir, isinstance(directory, unicode))
+    with _lock:
+        current = _snapshots.get(key)
+        if current is None or current.stamp != (stat.st_mtime, stat.st_size):
+            try:
+                paths = read_index(index_file)
+                if isinstance(directory, unicode):
+                    # A path that isn't UTF-8 raises a ValueError, and the
+                    # directories are walked instead
+                    paths = [file.decode('utf-8') for file in paths]
+                current = Snapshot(path, git_dir, paths, (stat.st_mtime, stat.st_size))
+            except (IOError, ValueError, struct.error):
+                return None
+            _snapshots[key] = current
+        return current
+
+
+def list_files(directory, prune=None, on_directory=None):
+    # Returns the absolute paths of the files below a directory, tracked and
+    # untracked, or None if the directory isn't in a git work tree and has to
+    # be walked instead. on_directory is called with each directory that is
+    # listed, as for iglob.
+    current = snapshot(directory)
+    if current is None:
+        return None
+    return current.list_files(directory, prune, on_directory)
+
+
+def state(git_dir):
+    # The mtimes and sizes of HEAD and the index, which change with every
+    # checkout, commit, merge or rebase
+    stamps = []
+    for name in ['HEAD', 'index']:
+        try:
+            stat = os.stat(os.path.join(git_dir, name))
+            # Lists rather than tuples, so that a state saved as JSON
+            # compares equal once it is loaded again
+            stamps.append([stat.st_mtime, stat.st_size])
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def read_index(index_file):
+    # Returns the sorted paths (relative to the work tree, with / as the
+    # separator) of the files in a git index. Supports index versions 2, 3
+    # and 4, the last of which compresses each path against the one before.
+    f = open(index_file, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    signature, version, count = struct.unpack_from('>4sII', data, 0)
+    if signature != 'DIRC' or version not in (2, 3, 4):
+        raise ValueError('Unsupported git index')
+
+    paths = []
+    position = 12
+    previous = ''
+    # The mode and flags of an entry, skipping its times, device, inode,
+    # uid, gid, size and object id
+    unpack_entry = struct.Struct('>24xI12x20xH').unpack_from
+    for i in xrange(count):
+        mode, flags = unpack_entry(data, position)
+        entry_start = position
+        position += 62
+        skip_worktree = False
+        if version >= 3 and flags & 0x4000:
+            # Extended flags, which mark files left out by a sparse checkout
+            skip_worktree = bool(struct.unpack_from('>H', data, position)[0] & 0x4000)
+            position += 2
+
+        if version == 4:
+            strip, position = read_offset(data, position)
+            end = data.index('\0', position)
+            path = previous[:len(previous) - strip] + data[position:end]
+            position = end + 1
+        else:
+            end = data.index('\0', position)
+            path = data[position:end]
+            # Entries are padded with NULs to a multiple of eight bytes
+            position = entry_start + ((end - entry_start + 8) & ~7)
+        previous = path
+
+        if skip_worktree or mode in (GITLINK_MODE, DIRECTORY_MODE):
+            continue
+        if paths and paths[-1] == path:
+            # A conflicted file has an entry per stage but is listed once
+            continue
+        paths.append(path)
+    return paths
+
+
+def read_offset(data, position):
+    # The variable length integers of index version 4
+    byte = ord(data[position])
+    position += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = ord(data[position])
+        position += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, position
+
+
+class Snapshot(object):
+    def __init__(self, path, git_dir, paths, stamp):
+        self.path = path
+        self.git_dir = git_dir
+        # The (mtime, size) of the index when it was read
+        self.stamp = stamp
+        self.paths = paths
+        # Maps each directory with tracked files below it to the names of
+        # the tracked files in it and of its subdirectories with tracked
+        # files in them
+        self.contents = {}
+        for file in paths:
+            directory, name = file.rpartition('/')[::2]
+            contents = self.contents.get(directory)
+            if contents is None:
+                contents = self.contents[directory] = (set(), set())
+                self.add_directory(directory)
+            contents[0].add(name)
+        lines = read_lines(os.path.join(path, '.gitignore')) + read_lines(os.path.join(git_dir, 'info', 'exclude'))
+        if isinstance(path, unicode):
+            lines = [line.decode('utf-8', 'replace') for line in lines]
+        self.ignored = IgnoreRules(lines)
+
+    def add_directory(self, directory):
+        while directory:
+            parent, name = directory.rpartition('/')[::2]
+            contents = self.contents.get(parent)
+            if contents is None:
+                contents = self.contents[parent] = (set(), set())
+            elif name in contents[1]:
+                return
+            contents[1].add(name)
+            directory = parent
+
+    def prefix(self, directory):
+        # A directory in the work tree as the start of the paths in the index
+        prefix = os.path.relpath(directory, self.path)
+        if prefix == '.':
+            return ''
+        return prefix.replace(os.sep, '/')
+
+    def changes(self, old, directory):
+        # Returns the absolute paths of the files below a directory that
+        # have been added to the index since an older snapshot of it, and of
+        # those that have been removed from it
+        prefix = self.prefix(directory)
+        new_files = set(self.files_below(prefix))
+        old_files = set(old.files_below(prefix))
+        return ([self.absolute_path(f) for f in sorted(new_files - old_files)],
+                [self.absolute_path(f) for f in sorted(old_files - new_files)])
+
+    def absolute_path(self, file):
+        if os.sep != '/':
+            file = file.replace('/', os.sep)
+        return os.path.join(self.path, file)
+
+    def list_files(self, directory, prune=None, on_directory=None):
+        prefix = self.prefix(directory)
+        if prefix not in self.contents:
+            # Nothing below the directory is tracked
+            return list(iglob(directory, '', prune, on_directory))
+        pruned = compile_prune(prune)
+        files = []
+        for directory_path in self.tracked_directories(prefix, pruned):
+            files.extend(self.list_directory(directory_path, pruned, prune, on_directory))
+        return [self.absolute_path(f) for f in files]
+
+    def files_below(self, prefix):
+        if not prefix:
+            return self.paths
+        start = bisect.bisect_left(self.paths, prefix + '/')
+        end = bisect.bisect_left(self.paths, prefix + '0')
+        return self.paths[start:end]
+
+    def tracked_directories(self, prefix, pruned):
+        # The directories below prefix with tracked files in them, leaving
+        # out those excluded by the prune patterns
+        directories = []
+        stack = [prefix]
+        while stack:
+            directory_path = stack.pop()
+            directories.append(directory_path)
+            for name in sorted(self.contents[directory_path][1], reverse=True):
+                if not (pruned and pruned.match(name)):
+                    stack.append(directory_path + '/' + name if directory_path else name)
+        return directories
+
+    def list_directory(self, directory_path, pruned, prune, on_directory=None):
+        # Lists a tracked directory, which takes a single call: the tracked
+        # files that are still there, and whatever git doesn't know about.
+        # Only the names that git doesn't know about are looked at more
+        # closely, to find out whether they are directories to walk.
+        tracked_files, tracked_directories = self.contents[directory_path]
+        directory = os.path.join(self.path, directory_path)
+        if on_directory:
+            on_directory(self.absolute_path(directory_path))
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        base = directory_path + '/' if directory_path else ''
+        files = [base + name for name in sorted(tracked_files.intersection(names))]
+        unknown = set(names) - tracked_files - tracked_directories
+        start_index = len(self.path) + 1
+        for name in sorted(unknown):
+            file = base + name
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                if not os.path.islink(path) and not (pruned and pruned.match(name)) \
+                        and not self.ignored.match(file, True):
+                    for found in iglob(path, '', prune, on_directory):
+                        found = found[start_index:].replace(os.sep, '/')
+                        if not self.ignored.match(found, False):
+                            files.append(found)
+            elif not self.ignored.match(file, False):
+                files.append(file)
+        return files
+
+
+class IgnoreRules(object):
+    # The simple cases of .gitignore patterns, from the .gitignore at the
+    # top of the work tree and .git/info/exclude: names (log, *.swp) that
+    # match at any depth, paths (/public/packs, config/*.yml) that match
+    # from the top, and patterns ending in / that only match directories.
+    # Negated patterns and .gitignore files further down are not supported;
+    # they only matter for files that git doesn't track yet.
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('!'):
+                continue
+            directory_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            self.rules.append((re.compile(fnmatch.translate(line.lstrip('/'))), anchored, directory_only))
+
+    def match(self, file, is_dir):
+        # Whether a path, or any of the directories it is in, is ignored
+        if not self.rules:
+            return False
+        parts = file.split('/')
+        for i in range(len(parts)):
+            partial_path = '/'.join(parts[:i + 1])
+            part_is_dir = is_dir or i < len(parts) - 1
+            for regex, anchored, directory_only in self.rules:
+                if directory_only and not part_is_dir:
+                    continue
+                if regex.match(partial_path if anchored else parts[i]):
+                    return True
+        return False
@@ -5,6 +5,73 @@
 # See the end of this file for the free software, open source license (BSD-style).
 
 import re
+import threading
+
+class LRUCache(object):
+    '''Bounded mapping that forgets the least recently used entry once it
+    is full. Lookups and insertions are O(1).'''
+
+    def __init__(self, size = 1000) :
+        self.size = size
+        self.entries = {}
+        # Circular doubly linked list of [previous, next, key, value] links,
+        # most recently used first
+        self.head = []
+        self.head[:] = [self.head, self.head, None, None]
+        self.lock = threading.Lock()
+
+    def get(self, key) :
+        '''Returns the value stored for key, or None'''
+        self.lock.acquire()
+        try :
+            link = self.entries.get(key)
+            if link is None :
+                return None
+            self._unlink(link)
+            self._push_front(link)
+            return link[3]
+        finally :
+            self.lock.release()
+
+    def set(self, key, value) :
+        self.lock.acquire()
+        try :
+            link = self.entries.get(key)
+            if link is not None :
+                self._unlink(link)
+            elif len(self.entries) >= self.size :
+                oldest = self.head[0]
+                self._unlink(oldest)
+                del self.entries[oldest[2]]
+            link = [None, None, key, value]
+            self._push_front(link)
+            self.entries[key] = link
+        finally :
+            self.lock.release()
+
+    def _unlink(self, link) :
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _push_front(self, link) :
+        first = self.head[1]
+        link[0] = self.head
+        link[1] = first
+        first[0] = link
+        self.head[1] = link
+
+
+def compile_rules(rules) :
+    '''Precompiles a list of [pattern, replacement] inflection rules'''
+    return [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in rules]
+
+
+def compile_irregular_words(irregular_words) :
+    '''Precompiles the patterns used to find and replace irregular words,
+    keeping the order in which they are tried'''
+    return [(re.compile('('+irregular+')$', re.IGNORECASE), re.compile('(?i)'+irregular+'$'), irregular_words[irregular][1:])
+            for irregular in irregular_words.keys()]
+
 
 class Base(object):
     '''Locale inflectors must inherit from this base class inorder to provide
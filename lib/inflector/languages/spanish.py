@@ -9,72 +9,114 @@
 # See the end of this file for the free software, open source license (BSD-style).
 
 import re
-from base import Base
+from base import Base, LRUCache, compile_rules, compile_irregular_words
 
 class Spanish (Base):
     '''
     Inflector for pluralize and singularize Spanish nouns.
     '''
 
+    # The rule tables are compiled once, when the module is loaded, and the
+    # results for the words seen most recently are remembered.
+
+    plural_rules = compile_rules([
+        ['(?i)([aeiou])x$', '\\1x'], # This could fail if the word is oxytone.
+        ['(?i)([])([ns])$', '|1\\2es'],
+        ['(?i)(^[bcdfghjklmnpqrstvwxyz]*)an$', '\\1anes'], # clan->clanes
+        ['(?i)([])s$', '|1ses'],
+        ['(?i)(^[bcdfghjklmnpqrstvwxyz]*)([aeiou])([ns])$', '\\1\\2\\3es'], # tren->trenes
+        ['(?i)([aeiou])$', '\\1s'], # casa->casas, padre->padres, pap->paps
+        ['(?i)([aeiou])s$', '\\1s'], # atlas->atlas, virus->virus, etc.
+        ['(?i)([])(s)$', '|1\\2es'], # ingls->ingleses
+        ['(?i)z$', 'ces'],  # luz->luces
+        ['(?i)([])$', '\\1es'], # ceut->ceutes, tab->tabes
+        ['(?i)(ng|[wckgtp])$', '\\1s'], # Anglicismos como puenting, frac, crack, show (En que casos podra fallar esto?)
+        ['(?i)$', 'es']	# ELSE +es (v.g. rbol->rboles)
+    ])
+
+    plural_uncountable_words = ['tijeras','gafas', 'vacaciones','vveres','dficit']
+    ''' In fact these words have no singular form: you cannot say neither
+    "una gafa" nor "un vvere". So we should change the variable name to
+    onlyplural or something alike.'''
+
+    plural_irregular_words = compile_irregular_words({
+        'pas' : 'pases',
+        'champ' : 'champs',
+        'jersey' : 'jersis',
+        'carcter' : 'caracteres',
+        'espcimen' : 'especmenes',
+        'men' : 'mens',
+        'rgimen' : 'regmenes',
+        'curriculum'  :  'currculos',
+        'ultimtum'  :  'ultimatos',
+        'memorndum'  :  'memorandos',
+        'referndum'  :  'referendos'
+    })
+
+    singular_rules = compile_rules([
+        ['(?i)^([bcdfghjklmnpqrstvwxyz]*)([aeiou])([ns])es$', '\\1\\2\\3'],
+        ['(?i)([aeiou])([ns])es$',  '~1\\2'],
+        ['(?i)oides$',  'oide'], # androides->androide
+        ['(?i)(ces)$/i', 'z'],
+        ['(?i)(sis|tis|xis)+$',  '\\1'], # crisis, apendicitis, praxis
+        ['(?i)()s$',  '\\1'], # bebs->beb
+        ['(?i)([^e])s$',  '\\1'], # casas->casa
+        ['(?i)([bcdfghjklmnprstvwxyz]{2,}e)s$', '\\1'], # cofres->cofre
+        ['(?i)([ghpv]e)s$', '\\1'], # 24-01 llaves->llave
+        ['(?i)es$', ''] # ELSE remove _es_  monitores->monitor
+    ])
+
+    singular_uncountable_words = ['paraguas','tijeras', 'gafas', 'vacaciones', 'vveres','lunes','martes','mircoles','jueves','viernes','cumpleaos','virus','atlas','sms']
+
+    singular_irregular_words = compile_irregular_words({
+        'jersey':'jersis',
+        'espcimen':'especmenes',
+        'carcter':'caracteres',
+        'rgimen':'regmenes',
+        'men':'mens',
+        'rgimen':'regmenes',
+        'curriculum' : 'currculos',
+        'ultimtum' : 'ultimatos',
+        'memorndum' : 'memorandos',
+        'referndum' : 'referendos',
+        'sndwich' : 'sndwiches'
+    })
+
+    plurals = LRUCache(1000)
+    singulars = LRUCache(1000)
+
     def pluralize(self, word) :
         '''Pluralizes Spanish nouns.'''
-        rules = [
-            ['(?i)([aeiou])x$', '\\1x'], # This could fail if the word is oxytone.
-            ['(?i)([])([ns])$', '|1\\2es'],
-            ['(?i)(^[bcdfghjklmnpqrstvwxyz]*)an$', '\\1anes'], # clan->clanes
-            ['(?i)([])s$', '|1ses'],
-            ['(?i)(^[bcdfghjklmnpqrstvwxyz]*)([aeiou])([ns])$', '\\1\\2\\3es'], # tren->trenes
-            ['(?i)([aeiou])$', '\\1s'], # casa->casas, padre->padres, pap->paps
-            ['(?i)([aeiou])s$', '\\1s'], # atlas->atlas, virus->virus, etc.
-            ['(?i)([])(s)$', '|1\\2es'], # ingls->ingleses
-            ['(?i)z$', 'ces'],  # luz->luces
-            ['(?i)([])$', '\\1es'], # ceut->ceutes, tab->tabes
-            ['(?i)(ng|[wckgtp])$', '\\1s'], # Anglicismos como puenting, frac, crack, show (En que casos podra fallar esto?)
-            ['(?i)$', 'es']	# ELSE +es (v.g. rbol->rboles)
-        ]
-
-        uncountable_words = ['tijeras','gafas', 'vacaciones','vveres','dficit']
-        ''' In fact these words have no singular form: you cannot say neither
-        "una gafa" nor "un vvere". So we should change the variable name to
-        onlyplural or something alike.'''
-
-        irregular_words = {
-            'pas' : 'pases',
-            'champ' : 'champs',
-            'jersey' : 'jersis',
-            'carcter' : 'caracteres',
-            'espcimen' : 'especmenes',
-            'men' : 'mens',
-            'rgimen' : 'regmenes',
-            'curriculum'  :  'currculos',
-            'ultimtum'  :  'ultimatos',
-            'memorndum'  :  'memorandos',
-            'referndum'  :  'referendos'
-        }
+        plural = self.plurals.get(word)
+        if plural is None :
+            plural = self.pluralize_word(word)
+            self.plurals.set(word, plural)
+        return plural
 
+    def pluralize_word(self, word) :
         lower_cased_word = word.lower();
 
-        for uncountable_word in uncountable_words:
+        for uncountable_word in self.plural_uncountable_words:
             if lower_cased_word[-1*len(uncountable_word):] == uncountable_word :
                 return word
 
-        for irregular in irregular_words.keys():
-            match = re.search('(?i)('+irregular+')$',word, re.IGNORECASE)
+        for irregular, irregular_at_end, tail in self.plural_irregular_words:
+            match = irregular.search(word)
             if match:
-                return re.sub('(?i)'+irregular+'$', match.expand('\\1')[0]+irregular_words[irregular][1:], word)
+                return irregular_at_end.sub(match.expand('\\1')[0]+tail, word)
 
 
-        for rule in range(len(rules)):
-            match = re.search(rules[rule][0], word, re.IGNORECASE)
+        for rule, rule_replacement in self.plural_rules:
+            match = rule.search(word)
 
             if match :
                 groups = match.groups()
-                replacement = rules[rule][1]
+                replacement = rule_replacement
                 if re.match('\|', replacement) :
                     for k in range(1, len(groups)) :
                         replacement = replacement.replace('|'+str(k), self.string_replace(groups[k-1], '', 'AEIOUaeiou'))
 
-                result = re.sub(rules[rule][0], replacement, word)
+                result = rule.sub(replacement, word)
                 # Esto acentua los sustantivos que al pluralizarse se convierten en esdrjulos como esmquines, jvenes...
                 match = re.search('(?i)([aeiou]).{1,3}([aeiou])nes$',result)
 
@@ -88,57 +130,34 @@ class Spanish (Base):
 
     def singularize (self, word) :
         '''Singularizes Spanish nouns.'''
+        singular = self.singulars.get(word)
+        if singular is None :
+            singular = self.singularize_word(word)
+            self.singulars.set(word, singular)
+        return singular
 
-        rules = [
-            ['(?i)^([bcdfghjklmnpqrstvwxyz]*)([aeiou])([ns])es$', '\\1\\2\\3'],
-            ['(?i)([aeiou])([ns])es$',  '~1\\2'],
-            ['(?i)oides$',  'oide'], # androides->androide
-            ['(?i)(ces)$/i', 'z'],
-            ['(?i)(sis|tis|xis)+$',  '\\1'], # crisis, apendicitis, praxis
-            ['(?i)()s$',  '\\1'], # bebs->beb
-            ['(?i)([^e])s$',  '\\1'], # casas->casa
-            ['(?i)([bcdfghjklmnprstvwxyz]{2,}e)s$', '\\1'], # cofres->cofre
-            ['(?i)([ghpv]e)s$', '\\1'], # 24-01 llaves->llave
-            ['(?i)es$', ''] # ELSE remove _es_  monitores->monitor
-        ];
-
-        uncountable_words = ['paraguas','tijeras', 'gafas', 'vacaciones', 'vveres','lunes','martes','mircoles','jueves','viernes','cumpleaos','virus','atlas','sms']
-
-        irregular_words = {
-            'jersey':'jersis',
-            'espcimen':'especmenes',
-            'carcter':'caracteres',
-            'rgimen':'regmenes',
-            'men':'mens',
-            'rgimen':'regmenes',
-            'curriculum' : 'currculos',
-            'ultimtum' : 'ultimatos',
-            'memorndum' : 'memorandos',
-            'referndum' : 'referendos',
-            'sndwich' : 'sndwiches'
-        }
-
+    def singularize_word(self, word) :
         lower_cased_word = word.lower();
 
-        for uncountable_word in uncountable_words:
+        for uncountable_word in self.singular_uncountable_words:
             if lower_cased_word[-1*len(uncountable_word):] == uncountable_word :
                 return word
 
-        for irregular in irregular_words.keys():
-            match = re.search('('+irregular+')$',word, re.IGNORECASE)
+        for irregular, irregular_at_end, tail in self.singular_irregular_words:
+            match = irregular.search(word)
             if match:
-                return re.sub('(?i)'+irregular+'$', match.expand('\\1')[0]+irregular_words[irregular][1:], word)
+                return irregular_at_end.sub(match.expand('\\1')[0]+tail, word)
 
-        for rule in range(len(rules)):
-            match = re.search(rules[rule][0], word, re.IGNORECASE)
+        for rule, rule_replacement in self.singular_rules:
+            match = rule.search(word)
             if match :
                 groups = match.groups()
-                replacement = rules[rule][1]
+                replacement = rule_replacement
                 if re.match('~', replacement) :
                     for k in range(1, len(groups)) :
                         replacement = replacement.replace('~'+str(k), self.string_replace(groups[k-1], 'AEIOUaeiou', ''))
 
-                result = re.sub(rules[rule][0], replacement, word)
+                result = rule.sub(replacement, word)
                 # Esta es una posible solucin para el problema de dobles acentos. Un poco guarrillo pero funciona
                 match = re.search('(?i)([]).*([])',result)
 
@@ -0,0 +1,110 @@
+import bisect
+import os
+import re
+
+# Lets files be found by the names that Rails code uses for them rather than
+# by their paths: 'Admin::UsersController', 'users_controller', 'users',
+# 'people' (for person.rb) or just the namespace, 'admin'. Every file gets a
+# few match keys up front, so that a search is a hash lookup followed by a
+# binary search for keys that start with the query.
+
+# Removed from file names to get at the resource they belong to
+RESOURCE_SUFFIXES = ['_controller', '_helper', '_mailer', '_serializer', '_spec', '_test']
+
+
+class MatchKeyTable(object):
+    def __init__(self, entries, version=None):
+        # Takes (category directory, file) pairs, both relative to the root
+        self.version = version
+        self.files = []
+        # Maps each key to the positions in self.files of the files with
+        # that key
+        self.keys = {}
+        for directory, file in entries:
+            position = len(self.files)
+            self.files.append(file)
+            for key in file_keys(directory, file):
+                positions = self.keys.get(key)
+                if positions is None:
+                    self.keys[key] = [position]
+                elif positions[-1] != position:
+                    positions.append(position)
+        self.sorted_keys = sorted(self.keys)
+
+    def search(self, query, inflector=None):
+        # Returns the files that have the query (or its singular or plural)
+        # as a key, followed by those with keys that start with it. Only if
+        # there are none of those, the keys that contain the letters of the
+        # query in the same order are tried.
+        variants = query_variants(query, inflector)
+        if not variants:
+            return []
+        positions = []
+        seen = set()
+
+        def add(matches):
+            for position in matches:
+                if position not in seen:
+                    seen.add(position)
+                    positions.append(position)
+
+        for variant in variants:
+            add(self.keys.get(variant, []))
+        for variant in variants:
+            i = bisect.bisect_left(self.sorted_keys, variant)
+            while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(variant):
+                add(self.keys[self.sorted_keys[i]])
+                i += 1
+
+        if not positions:
+            regex = re.compile('.*?'.join([re.escape(c) for c in variants[0]]))
+            for key in self.sorted_keys:
+                if regex.search(key):
+                    add(self.keys[key])
+        return [self.files[position] for position in positions]
+
+
+def file_keys(directory, file):
+    # The keys of app/controllers/admin/users_controller.rb are
+    # userscontroller, users, admin::userscontroller, admin::users and admin
+    relative = file[len(directory) + 1:] if file.startswith(directory + os.sep) else file
+    parts = relative.split(os.sep)
+    namespaces = [normalize(part) for part in parts[:-1]]
+    stem = parts[-1].split('.')[0]
+
+    names = [normalize(stem)]
+    for suffix in RESOURCE_SUFFIXES:
+        if stem.endswith(suffix) and len(stem) > len(suffix):
+            names.append(normalize(stem[:-len(suffix)]))
+            break
+
+    keys = list(names)
+    if namespaces:
+        namespace = '::'.join(namespaces)
+        keys.extend([namespace + '::' + name for name in names])
+        for i in range(len(namespaces)):
+            keys.append('::'.join(namespaces[:i + 1]))
+            keys.append(namespaces[i])
+    return keys
+
+
+def query_variants(query, inflector=None):
+    query = query.strip().lower().replace('/', '::')
+    words = [query]
+    if inflector and re.match(r'^[\w:]+$', query):
+        # Table names are plural and model files singular, so look for both
+        words.append(inflector.singularize(query))
+        words.append(inflector.pluralize(query))
+
+    variants = []
+    for word in words:
+        variant = normalize(word)
+        if variant and variant not in variants:
+            variants.append(variant)
+    return variants
+
+
+def normalize(name):
+    # Class names and file names compare equal once underscores, spaces and
+    # case are out of the way (UsersController, users_controller)
+    return re.sub(r'[_\s]', '', name.lower())
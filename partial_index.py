@@ -0,0 +1,379 @@
+import json
+import os
+import re
+import threading
+import background
+from file_index import cache_name
+from recursive_glob import iglob, list_entries
+
+INDEX_VERSION = 2
+
+VIEWS_DIR = os.path.join('app', 'views')
+CONTROLLERS_DIR = os.path.join('app', 'controllers')
+TEMPLATE_PATTERN = r'\.(?:erb|haml|slim)$'
+
+# One index per Rails root, shared by all commands and windows
+_indexes = {}
+
+# The arguments of a render call, up to the end of the line. That covers
+# ERB, Haml and Slim alike, since they all put Ruby on the line after the
+# markup that introduces it.
+RENDER = re.compile(r'\brender\b[ \t(]*([^\n]*)')
+# render 'shared/form', render "form"
+LEADING_NAME = re.compile(r'''^['"]([\w/.]+)['"]''')
+# render partial: 'form', render :partial => 'form', render layout: 'box'
+NAME_OPTION = re.compile(r'''(?:\b(?:partial|layout):|:(?:partial|layout)\s*=>)\s*['"]([\w/.]+)['"]''')
+# render @posts, render @user.posts, render collection: @posts
+COLLECTION = re.compile(r'^(?:(?:collection:|:collection\s*=>)\s*)?@(\w+(?:\.\w+)*)')
+# layout 'admin' or layout false in a controller
+LAYOUT = re.compile(r'''^[ \t]*layout[ \t(]+(?:['"]([\w/]+)['"]|(false|nil)\b)''', re.MULTILINE)
+
+
+def get_index(root, cache_dir=None):
+    index = _indexes.get(root)
+    if index is None:
+        index = PartialIndex(root, cache_dir)
+        index.load()
+        _indexes[root] = index
+    return index
+
+
+def file_changed(path, inflector=None):
+    for index in indexes_containing(path):
+        index.update_file(path, inflector)
+
+
+def file_removed(path):
+    for index in indexes_containing(path):
+        index.remove_file(path)
+
+
+def indexes_containing(path):
+    return [index for index in _indexes.values() if path.startswith(index.root + os.sep)]
+
+
+def save_all():
+    for index in _indexes.values():
+        if index.dirty:
+            index.save()
+
+
+def template_name(file):
+    # The name that render calls use for a template, relative to app/views
+    # and without extensions: app/views/users/_form.html.erb is users/_form
+    if file.startswith(VIEWS_DIR + os.sep):
+        file = file[len(VIEWS_DIR) + 1:]
+    directory, base = os.path.split(file)
+    name = base.split('.')[0]
+    if directory:
+        name = '/'.join(directory.split(os.sep) + [name])
+    return name
+
+
+def partial_name(reference, template):
+    # Resolves a partial reference the way Rails does: users/form is
+    # users/_form, while a bare form is looked for next to the template
+    # that renders it
+    reference = reference.lstrip('/')
+    directory, slash, base = reference.rpartition('/')
+    base = base.split('.')[0]
+    if not directory:
+        directory = template.rpartition('/')[0]
+    if directory:
+        return '%s/_%s' % (directory, base)
+    return '_' + base
+
+
+def scan_renders(source, template, inflector=None):
+    # Returns (partial name, line number) pairs for the partials rendered by
+    # the source of a template, given the template's own name
+    renders = []
+    if 'render' not in source:
+        return renders
+    line = 1
+    position = 0
+    for match in RENDER.finditer(source):
+        line += source.count('\n', position, match.start())
+        position = match.start()
+        for name in rendered_names(match.group(1), template, inflector):
+            renders.append((name, line))
+    return renders
+
+
+def rendered_names(arguments, template, inflector=None):
+    names = []
+    arguments = arguments.strip()
+    match = LEADING_NAME.match(arguments)
+    if match:
+        names.append(partial_name(match.group(1), template))
+    for match in NAME_OPTION.finditer(arguments):
+        names.append(partial_name(match.group(1), template))
+    if not names and inflector:
+        match = COLLECTION.match(arguments)
+        if match:
+            # render @posts renders posts/_post for each post
+            collection = match.group(1).split('.')[-1]
+            singular = inflector.singularize(collection)
+            names.append('%s/_%s' % (inflector.pluralize(singular), singular))
+    return names
+
+
+def controller_directory(file):
+    # The template directory of a controller: admin/users for
+    # app/controllers/admin/users_controller.rb, or None for other files
+    if not file.startswith(CONTROLLERS_DIR + os.sep) or not file.endswith('_controller.rb'):
+        return None
+    return '/'.join(file[len(CONTROLLERS_DIR) + 1:-len('_controller.rb')].split(os.sep))
+
+
+class PartialIndex(object):
+    def __init__(self, root, cache_dir=None):
+        self.root = root
+        self.cache_dir = cache_dir
+        # Glob patterns for the names of directories that are never walked
+        self.excluded_directories = []
+        # Maps each template (relative to the root) to its mtime and the
+        # (partial name, line number) pairs of the partials it renders
+        self.files = {}
+        # Maps the template directories whose controllers declare a layout
+        # (admin/users for app/controllers/admin/users_controller.rb) to the
+        # name of that layout, or to False for none
+        self.layouts = {}
+        # Maps template names to their files, and partial names to the
+        # (file, line number) pairs that render them. Both are derived from
+        # self.files when they are first asked for after a change.
+        self.templates = None
+        self.callers = None
+        # Whether the templates have been checked for changes since the
+        # editor was started; until then, what was loaded from disk may be
+        # stale
+        self.scanned = False
+        self.dirty = False
+        # Scans run on a worker thread while the main thread reads the
+        # index or updates it for saved files
+        self.lock = threading.RLock()
+
+    def set_excluded_directories(self, excluded_directories):
+        with self.lock:
+            self.excluded_directories = list(excluded_directories or [])
+
+    def scan(self, inflector=None):
+        # Lists the templates and reads only those that are new or have
+        # changed since they were last read, one views directory per worker.
+        # The layouts that the controllers declare are read along the way.
+        with self.lock:
+            known = dict(self.files)
+        views = os.path.join(self.root, VIEWS_DIR)
+        try:
+            entries = list_entries(views)
+        except OSError:
+            entries = []
+        files = {}
+        layouts = {}
+        # Templates right in app/views, which no controller renders on its own
+        for name, is_dir in entries:
+            if not is_dir and re.search(TEMPLATE_PATTERN, name):
+                self.scan_file(os.path.join(views, name), known, inflector, files)
+        directories = [os.path.join(views, name) for name, is_dir in entries if is_dir]
+        for found, found_layouts in background.map_parallel(
+                lambda directory: self.scan_directory(directory, known, inflector), directories):
+            files.update(found)
+            layouts.update(found_layouts)
+        with self.lock:
+            self.files = files
+            self.layouts = layouts
+            self.templates = None
+            self.callers = None
+            self.scanned = True
+            self.save()
+
+    def scan_directory(self, directory, known, inflector=None):
+        files = {}
+        layouts = {}
+        checked = set()
+        for path in iglob(directory, TEMPLATE_PATTERN, self.excluded_directories):
+            file = self.scan_file(path, known, inflector, files)
+            template_directory = template_name(file).rpartition('/')[0]
+            if template_directory not in checked:
+                checked.add(template_directory)
+                layout = self.declared_layout(template_directory)
+                if layout is not None:
+                    layouts[template_directory] = layout
+        return files, layouts
+
+    def scan_file(self, path, known, inflector, files):
+        # Adds the entry of a template to files, reading it only if it is
+        # not known yet or has changed, and returns its relative path
+        file = path[len(self.root) + 1:]
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return file
+        entry = known.get(file)
+        if entry is None or entry[0] != mtime:
+            entry = [mtime, self.read_renders(path, file, inflector)]
+        files[file] = entry
+        return file
+
+    def declared_layout(self, directory):
+        # The layout declared by the controller of a template directory:
+        # its name, False for layout false, or None when there is no
+        # declaration we can follow (such as layout :method, or one made in
+        # a superclass)
+        path = os.path.join(self.root, CONTROLLERS_DIR, *directory.split('/')) + '_controller.rb'
+        try:
+            f = open(path)
+            try:
+                match = LAYOUT.search(f.read())
+            finally:
+                f.close()
+        except IOError:
+            return None
+        if not match:
+            return None
+        if match.group(2):
+            return False
+        return 'layouts/' + match.group(1)
+
+    def read_renders(self, path, file, inflector=None):
+        try:
+            f = open(path)
+            try:
+                return scan_renders(f.read(), template_name(file), inflector)
+            finally:
+                f.close()
+        except IOError:
+            return []
+
+    def update_file(self, path, inflector=None):
+        file = self.relative_path(path)
+        directory = controller_directory(file)
+        if directory:
+            layout = self.declared_layout(directory)
+            with self.lock:
+                if self.layouts.get(directory) != layout:
+                    if layout is None:
+                        del self.layouts[directory]
+                    else:
+                        self.layouts[directory] = layout
+                    self.dirty = True
+            return
+        if not file.startswith(VIEWS_DIR + os.sep) or not re.search(TEMPLATE_PATTERN, file) \
+                or not os.path.isfile(path):
+            return
+        entry = [os.path.getmtime(path), self.read_renders(path, file, inflector)]
+        with self.lock:
+            self.files[file] = entry
+            self.templates = None
+            self.callers = None
+            self.dirty = True
+
+    def remove_file(self, path):
+        file = self.relative_path(path)
+        with self.lock:
+            directory = controller_directory(file)
+            if directory in self.layouts:
+                del self.layouts[directory]
+                self.dirty = True
+            if file in self.files:
+                del self.files[file]
+                self.templates = None
+                self.callers = None
+                self.dirty = True
+
+    def derive(self):
+        with self.lock:
+            if self.templates is None:
+                templates = {}
+                callers = {}
+                for file, (mtime, renders) in self.files.items():
+                    templates.setdefault(template_name(file), []).append(file)
+                    for name, line in renders:
+                        callers.setdefault(name, []).append((file, line))
+                for entries in templates.values():
+                    entries.sort()
+                for entries in callers.values():
+                    entries.sort()
+                self.templates = templates
+                self.callers = callers
+            return self.templates, self.callers
+
+    def template_files(self, name):
+        # The files of a template or partial (users/_form.html.erb and
+        # users/_form.json.jbuilder are both users/_form)
+        return self.derive()[0].get(name, [])
+
+    def renders(self, file):
+        with self.lock:
+            entry = self.files.get(file)
+        return entry[1] if entry else []
+
+    def rendered_by(self, file):
+        # The (file, line number) pairs of the templates that render the
+        # partial in the given file
+        return self.derive()[1].get(template_name(file), [])
+
+    def layout_files(self, file):
+        # The layout that a template is probably rendered in: the one its
+        # controller declares, the one named after its controller, or else
+        # the application layout
+        directory = template_name(file).rpartition('/')[0]
+        with self.lock:
+            declared = self.layouts.get(directory)
+        if declared is False:
+            return []
+        names = declared and [declared] or []
+        if directory:
+            names.append('layouts/' + directory)
+        names.append('layouts/application')
+        for name in names:
+            files = self.template_files(name)
+            if files:
+                return files
+        return []
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.root)
+
+    def cache_file(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, cache_name(self.root) + '.partials.json')
+
+    def load(self):
+        cache_file = self.cache_file()
+        if not cache_file or not os.path.exists(cache_file):
+            return
+        try:
+            f = open(cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # A missing or corrupt cache just means reading all templates again
+            return
+        if data.get('version') == INDEX_VERSION and data.get('root') == self.root:
+            self.files = data['files']
+            self.layouts = data['layouts']
+
+    def save(self):
+        cache_file = self.cache_file()
+        if not cache_file:
+            return
+        with self.lock:
+            self.write(cache_file)
+
+    def write(self, cache_file):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(cache_file, 'w')
+            try:
+                json.dump({'version': INDEX_VERSION, 'root': self.root, 'files': self.files,
+                           'layouts': self.layouts}, f)
+            finally:
+                f.close()
+            self.dirty = False
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,84 @@
+import time
+from collections import deque
+
+# Rolling timing samples for the phases of each navigation command, recorded
+# only when the "performance_stats" setting is on. Printed to the console by
+# the show_rails_navigation_stats command.
+
+SAMPLES_PER_PHASE = 200
+
+enabled = False
+
+# Maps (command, phase) to the most recent durations in seconds
+_durations = {}
+# Maps command to the number of files listed by its most recent runs
+_file_counts = {}
+# Maps (command, source) to the number of runs whose files came from that
+# source: 'cache' when the index already had them, 'scan' when a directory
+# had to be walked
+_sources = {}
+
+
+class timed(object):
+    def __init__(self, command, phase):
+        self.command = command
+        self.phase = phase
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if enabled:
+            record(self.command, self.phase, time.time() - self.start)
+        return False
+
+
+def record(command, phase, seconds):
+    if not enabled:
+        return
+    samples = _durations.get((command, phase))
+    if samples is None:
+        samples = _durations[(command, phase)] = deque(maxlen=SAMPLES_PER_PHASE)
+    samples.append(seconds)
+
+
+def record_result(command, file_count, source):
+    if not enabled:
+        return
+    counts = _file_counts.get(command)
+    if counts is None:
+        counts = _file_counts[command] = deque(maxlen=SAMPLES_PER_PHASE)
+    counts.append(file_count)
+    _sources[(command, source)] = _sources.get((command, source), 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def report():
+    if not _durations:
+        if enabled:
+            return 'SublimeRailsNav: no navigation commands have been timed yet'
+        return 'SublimeRailsNav: set "performance_stats" to true to time the navigation commands'
+
+    lines = ['SublimeRailsNav performance (last %d runs per phase, times in ms)' % SAMPLES_PER_PHASE,
+             '%-30s %-18s %6s %8s %8s %8s %8s' % ('command', 'phase', 'runs', 'p50', 'p90', 'p99', 'max')]
+    for command, phase in sorted(_durations):
+        values = sorted(_durations[(command, phase)])
+        lines.append('%-30s %-18s %6d %8.1f %8.1f %8.1f %8.1f' % (
+            command, phase, len(values),
+            percentile(values, 0.5) * 1000, percentile(values, 0.9) * 1000,
+            percentile(values, 0.99) * 1000, values[-1] * 1000))
+
+    lines.append('')
+    lines.append('%-30s %10s %10s %10s' % ('command', 'avg files', 'cached', 'scanned'))
+    for command in sorted(_file_counts):
+        counts = _file_counts[command]
+        lines.append('%-30s %10d %10d %10d' % (
+            command, sum(counts) / len(counts),
+            _sources.get((command, 'cache'), 0), _sources.get((command, 'scan'), 0)))
+    return '\n'.join(lines)
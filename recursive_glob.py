@@ -1,12 +1,75 @@
 # Inspired by http://stackoverflow.com/a/2186639
 
+import fnmatch
 import os
 import re
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Backport of os.scandir for older Pythons, if it is installed
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
-def rglob(treeroot, pattern):
-    results = []
-    for base, dirs, files in os.walk(treeroot):
-        goodfiles = filter(lambda x: re.search(pattern, x), files)
-        results.extend(os.path.join(base, f) for f in goodfiles)
-    return results
+
+def iglob(treeroot, pattern, prune=None, on_directory=None):
+    # Yields the files below treeroot whose names match pattern, in the same
+    # order as os.walk would find them. Subdirectories whose names match one
+    # of the glob patterns in prune are skipped entirely, and so are
+    # symlinked directories. If on_directory is given, it is called with
+    # each directory that is walked, just before it is read.
+    regex = re.compile(pattern)
+    pruned = compile_prune(prune)
+    stack = [treeroot]
+    while stack:
+        directory = stack.pop()
+        if on_directory:
+            on_directory(directory)
+        try:
+            entries = list_entries(directory)
+        except OSError:
+            continue
+
+        subdirectories = []
+        for name, is_dir in entries:
+            if is_dir:
+                if not (pruned and pruned.match(name)):
+                    subdirectories.append(os.path.join(directory, name))
+            elif is_dir is False and regex.search(name):
+                yield os.path.join(directory, name)
+        subdirectories.reverse()
+        stack.extend(subdirectories)
+
+
+def rglob(treeroot, pattern, prune=None, on_directory=None):
+    return list(iglob(treeroot, pattern, prune, on_directory))
+
+
+def compile_prune(prune):
+    if not prune:
+        return None
+    return re.compile('|'.join(fnmatch.translate(name) for name in prune))
+
+
+def list_entries(directory):
+    # Returns (name, is_dir) pairs for the entries of directory, where is_dir
+    # is None for symlinks to directories, which are neither listed nor
+    # followed. scandir gets the entry types from the directory listing
+    # itself; without it every entry needs a stat, like in os.walk.
+    entries = []
+    if scandir:
+        for entry in scandir(directory):
+            if entry.is_dir():
+                entries.append((entry.name, None if entry.is_symlink() else True))
+            else:
+                entries.append((entry.name, False))
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                entries.append((name, None if os.path.islink(path) else True))
+            else:
+                entries.append((name, False))
+    return entries
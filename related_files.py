@@ -0,0 +1,76 @@
+import os
+import re
+
+# Each matcher tells whether a listed file is related to the current one, and
+# can also look up the related files directly, reading at most one directory,
+# for commands that open them without listing everything. Matchers are built
+# from absolute paths; relative_to gives one for lists of paths relative to a
+# directory.
+
+
+class ExactPaths(object):
+    # Matches a fixed set of absolute paths with a hash lookup
+    def __init__(self, *paths):
+        self.paths = set(paths)
+
+    def search(self, file):
+        return file in self.paths
+
+    def relative_to(self, directory):
+        return ExactPaths(*[relative_path(path, directory) for path in self.paths])
+
+    def candidates(self):
+        return [path for path in sorted(self.paths) if os.path.isfile(path)]
+
+
+class PathPrefix(object):
+    # Matches everything below a directory, or all files whose names start
+    # the same way
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def search(self, file):
+        return file.startswith(self.prefix)
+
+    def relative_to(self, directory):
+        return PathPrefix(relative_path(self.prefix, directory))
+
+    def candidates(self):
+        return [path for path in list_directory(os.path.dirname(self.prefix))
+                if self.search(path)]
+
+
+class PathPattern(object):
+    # For the rare cases where the related files can't be spelled out: the
+    # literal start of the path followed by a regular expression
+    def __init__(self, literal_path, pattern):
+        self.literal_path = literal_path
+        self.pattern = pattern
+        self.regex = re.compile(re.escape(literal_path) + pattern)
+
+    def search(self, file):
+        return self.regex.match(file)
+
+    def relative_to(self, directory):
+        return PathPattern(relative_path(self.literal_path, directory), self.pattern)
+
+    def candidates(self):
+        return [path for path in list_directory(os.path.dirname(self.literal_path))
+                if self.search(path)]
+
+
+def list_directory(directory):
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def relative_path(path, directory):
+    # The path relative to directory, or the path itself when it lies
+    # elsewhere
+    if path.startswith(directory + os.sep):
+        return path[len(directory) + 1:]
+    if path == directory:
+        return ''
+    return path
@@ -0,0 +1,445 @@
+import os
+import re
+import threading
+
+# Knows which routes config/routes.rb defines, so that a URL helper name, a
+# URL or a controller#action can be taken straight to the controller action
+# and its view. Understands the usual routing DSL (resources, resource,
+# namespace, scope, member and collection blocks, verb routes, root, concerns
+# and draw), not arbitrary Ruby; anything else in the file is skipped.
+
+# One index per Rails root
+_indexes = {}
+
+# The actions of resources: (action, verb, path, name prefix, on member)
+RESOURCES_ACTIONS = [
+    ('index', 'GET', '', '', False),
+    ('create', 'POST', '', None, False),
+    ('new', 'GET', '/new', 'new_', True),
+    ('edit', 'GET', '/:id/edit', 'edit_', True),
+    ('show', 'GET', '/:id', '', True),
+    ('update', 'PATCH', '/:id', None, True),
+    ('destroy', 'DELETE', '/:id', None, True)
+]
+
+# The actions of a singular resource: (action, verb, path, name prefix)
+RESOURCE_ACTIONS = [
+    ('show', 'GET', '', ''),
+    ('create', 'POST', '', None),
+    ('new', 'GET', '/new', 'new_'),
+    ('edit', 'GET', '/edit', 'edit_'),
+    ('update', 'PATCH', '', None),
+    ('destroy', 'DELETE', '', None)
+]
+
+VERBS = ['get', 'post', 'put', 'patch', 'delete', 'match']
+
+BLOCK_START = re.compile(r'\bdo\b\s*(?:\|[^|]*\|)?\s*$')
+STATEMENT = re.compile(r'^(\w+)[ \t(]*(.*?)[ \t)]*(?:\bdo\b\s*(?:\|[^|]*\|)?)?$')
+
+
+def get_index(root):
+    index = _indexes.get(root)
+    if index is None:
+        index = _indexes[root] = RoutesIndex(root)
+    return index
+
+
+class Route(object):
+    __slots__ = ('name', 'verb', 'path', 'controller', 'action', 'file', 'line')
+
+    def __init__(self, name, verb, path, controller, action, file, line):
+        self.name = name
+        self.verb = verb
+        self.path = path or '/'
+        self.controller = controller
+        self.action = action
+        self.file = file
+        self.line = line
+
+    def target(self):
+        return '%s#%s' % (self.controller, self.action)
+
+
+class RoutesIndex(object):
+    def __init__(self, root):
+        self.root = root
+        self.routes = []
+        # The mtimes of the routes files that the routes were parsed from
+        # (None for files that were drawn but didn't exist)
+        self.mtimes = {}
+        self.lock = threading.Lock()
+
+    def current_routes(self, inflector):
+        with self.lock:
+            if not self.mtimes or self.stale():
+                parser = RoutesParser(self.root, inflector)
+                parser.parse_file(os.path.join('config', 'routes.rb'))
+                self.routes = parser.routes
+                self.mtimes = parser.mtimes
+            return self.routes
+
+    def stale(self):
+        for file, mtime in self.mtimes.items():
+            if file_mtime(os.path.join(self.root, file)) != mtime:
+                return True
+        return False
+
+    def by_name(self, name, inflector):
+        # Takes a URL helper name, with or without _path or _url
+        name = re.sub(r'_(?:path|url)$', '', name)
+        return [route for route in self.current_routes(inflector) if route.name == name]
+
+    def by_url(self, url, inflector):
+        path = re.sub(r'^\w+://[^/]+', '', url).split('?')[0].split('#')[0]
+        path = re.sub(r'\.\w+$', '', path).rstrip('/') or '/'
+        found = []
+        for route in self.current_routes(inflector):
+            if re.match(path_pattern(route.path), path):
+                found.append(route)
+        # A URL that is typed or linked to is most likely a GET
+        found.sort(key=lambda route: route.verb != 'GET')
+        return found
+
+    def by_target(self, target, inflector):
+        return [route for route in self.current_routes(inflector) if route.target() == target]
+
+
+def path_pattern(path):
+    # A regular expression for the URLs that a route path matches, with
+    # :id and the like standing for a single segment and *path globs for
+    # any number of them. The literal parts are escaped on their own, since
+    # re.escape escapes the underscores of parameter names as well.
+    parts = re.split(r'([:*]\w+)', path)
+    pattern = ''
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            pattern += re.escape(part)
+        elif part.startswith('*'):
+            pattern += '.+'
+        else:
+            pattern += '[^/]+'
+    return '^%s$' % pattern
+
+
+class RoutesParser(object):
+    def __init__(self, root, inflector):
+        self.root = root
+        self.inflector = inflector
+        self.routes = []
+        self.mtimes = {}
+        # One frame per open block, each with the path, name and controller
+        # module that apply inside it, and for resources, their member and
+        # collection paths and names
+        self.frames = [{'kind': 'root', 'path': '', 'name': '', 'module': ''}]
+        # Maps the name of each concern to the (line, file, line number)
+        # triples of its body, which are parsed wherever it is used
+        self.concerns = {}
+        # The concern whose body is being read: its name, the lines so far
+        # and the number of blocks opened in it that are still open
+        self.recording = None
+
+    def parse_file(self, file):
+        path = os.path.join(self.root, file)
+        self.mtimes[file] = file_mtime(path)
+        try:
+            f = open(path)
+            try:
+                lines = f.read().split('\n')
+            finally:
+                f.close()
+        except IOError:
+            return
+        for number, line in enumerate(lines):
+            self.parse_line(strip_comment(line).strip(), file, number + 1)
+
+    def parse_line(self, line, file, number):
+        if not line:
+            return
+        if self.recording:
+            self.record_line(line, file, number)
+            return
+        if re.match(r'^end\b', line):
+            if len(self.frames) > 1:
+                self.frames.pop()
+            return
+
+        match = STATEMENT.match(line)
+        opens_block = bool(BLOCK_START.search(line))
+        keyword = match and match.group(1)
+        arguments = match and match.group(2) or ''
+        frame = self.frames[-1]
+
+        if keyword == 'namespace':
+            options = keyword_arguments(arguments)
+            name = positional(arguments)[0]
+            path = options.get('path', name)
+            module = options.get('module', name)
+            self.push(opens_block, 'namespace', path=join_path(frame['path'], path),
+                      name=frame['name'] + (options.get('as') or name) + '_',
+                      module=frame['module'] + (module and module + '/'), controller=None)
+        elif keyword == 'scope':
+            options = keyword_arguments(arguments)
+            path = (positional(arguments) or [options.get('path', '')])[0]
+            name = options.get('as') and options['as'] + '_' or ''
+            module = options.get('module') and options['module'] + '/' or ''
+            self.push(opens_block, 'scope', path=join_path(frame['path'], path),
+                      name=frame['name'] + name, module=frame['module'] + module,
+                      controller=None)
+        elif keyword in ('resources', 'resource'):
+            options = keyword_arguments(arguments)
+            concerns = as_list(options.get('concerns')) or []
+            for resource in positional(arguments):
+                self.add_resource(keyword == 'resources', resource, options, file, number)
+                if concerns:
+                    self.push_resource(keyword == 'resources', resource, options)
+                    self.replay_concerns(concerns)
+                    self.frames.pop()
+            if opens_block:
+                self.push_resource(keyword == 'resources', positional(arguments)[-1], options)
+        elif keyword == 'concern' and opens_block:
+            self.recording = (positional(arguments)[0], [], 0)
+        elif keyword == 'concerns':
+            self.replay_concerns(positional(arguments) or as_list(argument_value(arguments)))
+        elif keyword in ('member', 'collection') and opens_block:
+            self.push(True, keyword)
+        elif keyword in VERBS:
+            self.add_verb_route(keyword, arguments, file, number)
+        elif keyword == 'root':
+            options = keyword_arguments(arguments)
+            target = (positional(arguments) or [options.get('to', '')])[0]
+            self.add_target_route(frame['name'] + 'root', 'GET', frame['path'], target, file, number)
+        elif keyword == 'draw':
+            self.parse_file(os.path.join('config', 'routes', positional(arguments)[0] + '.rb'))
+        elif opens_block or opens_statement(line):
+            # constraints, defaults and the like: the routes inside apply as
+            # if the block wasn't there
+            self.push(True, 'block')
+
+    def record_line(self, line, file, number):
+        # Keeps the lines of a concern until the end of its block
+        name, lines, depth = self.recording
+        if re.match(r'^end\b', line):
+            if depth == 0:
+                self.concerns[name] = lines
+                self.recording = None
+                return
+            depth -= 1
+        elif BLOCK_START.search(line) or opens_statement(line):
+            depth += 1
+        lines.append((line, file, number))
+        self.recording = (name, lines, depth)
+
+    def replay_concerns(self, names):
+        # Parses the bodies of the concerns as if they were written here;
+        # the routes keep the lines of the concern they come from
+        depth = len(self.frames)
+        for name in names:
+            for line, file, number in self.concerns.get(name, []):
+                self.parse_line(line, file, number)
+        del self.frames[depth:]
+
+    def push(self, opens_block, kind, **values):
+        if not opens_block:
+            return
+        frame = dict(self.frames[-1])
+        frame['kind'] = kind
+        frame.update(values)
+        self.frames.append(frame)
+
+    def resource_names(self, plural, resource, options):
+        frame = self.frames[-1]
+        name = options.get('as') or resource
+        path = frame['path'] + '/' + (options.get('path') or resource)
+        if plural:
+            controller = options.get('controller') or resource
+            singular = self.inflector.singularize(name)
+        else:
+            controller = options.get('controller') or self.inflector.pluralize(resource)
+            singular = name
+        module = frame['module'] + (options.get('module') and options['module'] + '/' or '')
+        return {'collection_path': path, 'member_path': plural and path + '/:id' or path,
+                'collection_name': frame['name'] + name, 'member_name': frame['name'] + singular,
+                'controller': module + controller, 'singular': singular}
+
+    def add_resource(self, plural, resource, options, file, number):
+        names = self.resource_names(plural, resource, options)
+        actions = plural and RESOURCES_ACTIONS or [action + (True,) for action in RESOURCE_ACTIONS]
+        only = as_list(options.get('only'))
+        excepted = as_list(options.get('except')) or []
+        for action, verb, path, name_prefix, member in actions:
+            if (only is not None and action not in only) or action in excepted:
+                continue
+            name = None
+            if name_prefix is not None:
+                name = name_prefix + (member and names['member_name'] or names['collection_name'])
+            self.routes.append(Route(name, verb, names['collection_path'] + path,
+                                     names['controller'], action, file, number))
+
+    def push_resource(self, plural, resource, options):
+        names = self.resource_names(plural, resource, options)
+        # Routes nested in resources take the id of the parent resource
+        nested_path = plural and names['collection_path'] + '/:%s_id' % names['singular'] or names['collection_path']
+        self.push(True, 'resource', path=nested_path, name=names['member_name'] + '_',
+                  member_path=names['member_path'], collection_path=names['collection_path'],
+                  member_name=names['member_name'], collection_name=names['collection_name'],
+                  controller=names['controller'])
+
+    def add_verb_route(self, verb, arguments, file, number):
+        frame = self.frames[-1]
+        options = keyword_arguments(arguments)
+        arrow = re.match(r'''^\s*['"]([^'"]*)['"]\s*=>\s*['"]([^'"]*)['"]''', arguments)
+        if arrow:
+            path, options['to'] = arrow.group(1), arrow.group(2)
+        else:
+            path = (positional(arguments) or [''])[0]
+        verb = verb == 'match' and 'GET' or verb.upper()
+
+        on = options.get('on') or (frame['kind'] in ('member', 'collection') and frame['kind'])
+        if frame.get('controller') and on:
+            # get :preview in a member or collection block
+            action = options.get('action') or path
+            base = on == 'member' and frame['member_path'] or frame['collection_path']
+            name = options.get('as') or action
+            name += '_' + (on == 'member' and frame['member_name'] or frame['collection_name'])
+            self.routes.append(Route(name, verb, base + '/' + path, frame['controller'],
+                                     action, file, number))
+            return
+
+        if frame.get('controller') and not options.get('to') and not options.get('controller'):
+            # get :preview directly in a resources block
+            action = options.get('action') or path
+            name = frame['name'] + (options.get('as') or action)
+            self.routes.append(Route(name, verb, join_path(frame['path'], path), frame['controller'],
+                                     action, file, number))
+            return
+
+        name = None
+        if options.get('as'):
+            name = frame['name'] + options['as']
+        elif not re.search(r'[:*(]', path):
+            name = frame['name'] + re.sub(r'[^\w]+', '_', path.strip('/'))
+        target = options.get('to')
+        if not target:
+            controller = options.get('controller')
+            action = options.get('action')
+            if controller and action:
+                target = '%s#%s' % (controller, action)
+            elif '/' in path.strip('/'):
+                # get 'pages/about' routes to pages#about
+                target = '#'.join(path.strip('/').rsplit('/', 1))
+        self.add_target_route(name, verb, join_path(frame['path'], path), target, file, number)
+
+    def add_target_route(self, name, verb, path, target, file, number):
+        if not target or '#' not in target:
+            return
+        controller, action = target.split('#', 1)
+        self.routes.append(Route(name, verb, path, self.frames[-1]['module'] + controller,
+                                 action, file, number))
+
+
+def method_line(path, method):
+    # The line of a Ruby file where the given method is defined, or the
+    # first line if it isn't (e.g. because it is inherited)
+    try:
+        f = open(path)
+        try:
+            source = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return 1
+    match = re.search(r'^[ \t]*def[ \t]+%s\b' % re.escape(method), source, re.MULTILINE)
+    if not match:
+        return 1
+    return source.count('\n', 0, match.start()) + 1
+
+
+def strip_comment(line):
+    # Removes a trailing comment, leaving any # in strings ('users#index')
+    quote = None
+    for i, c in enumerate(line):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c == '#':
+            return line[:i]
+    return line
+
+
+def opens_statement(line):
+    # The Ruby statements that are closed by an end without a do
+    return re.match(r'^(?:if|unless|case|begin|while|until)\b', line)
+
+
+def split_arguments(arguments):
+    # Splits on the commas that are not in brackets or strings
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(arguments):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts.append(arguments[start:i].strip())
+            start = i + 1
+    parts.append(arguments[start:].strip())
+    return [part for part in parts if part]
+
+
+def positional(arguments):
+    values = []
+    for part in split_arguments(arguments):
+        match = re.match(r'''^(?::(\w+)|['"]([^'"]*)['"])$''', part)
+        if match:
+            values.append(match.group(1) or match.group(2))
+    return values
+
+
+def keyword_arguments(arguments):
+    options = {}
+    for part in split_arguments(arguments):
+        match = re.match(r'''^:?(\w+)(?::\s+|\s*=>\s*)(.+)$''', part)
+        if match:
+            options[match.group(1)] = argument_value(match.group(2).strip())
+    return options
+
+
+def argument_value(value):
+    match = re.match(r'''^(?::(\w+)|['"]([^'"]*)['"])$''', value)
+    if match:
+        return match.group(1) or match.group(2)
+    match = re.match(r'^(?:%[iw])?\[(.*)\]$', value)
+    if match:
+        return [item.strip(' :\'"') for item in re.split(r'[,\s]+', match.group(1)) if item.strip(' :\'"')]
+    return value
+
+
+def as_list(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def join_path(base, path):
+    path = path.strip('/')
+    return path and base + '/' + path or base
+
+
+def file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
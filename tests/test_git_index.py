@@ -0,0 +1,146 @@
+# Tests for reading git indexes, with indexes built byte by byte so that
+# every version and entry kind is covered whatever git version is installed.
+#
+#   python -m unittest discover tests
+#
+# Like the plugin itself, this needs Python 2.
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import git_index
+
+FILE_MODE = 0100644
+EXTENDED = 0x4000
+SKIP_WORKTREE = 0x4000
+
+
+def encode_offset(value):
+    # The inverse of git_index.read_offset
+    encoded = [value & 0x7f]
+    value >>= 7
+    while value:
+        value -= 1
+        encoded.insert(0, 0x80 | (value & 0x7f))
+        value >>= 7
+    return ''.join([chr(byte) for byte in encoded])
+
+
+def build_index(version, entries):
+    # Takes (path, mode, stage, skip worktree) tuples in index order
+    data = struct.pack('>4sII', 'DIRC', version, len(entries))
+    previous = ''
+    for path, mode, stage, skip_worktree in entries:
+        flags = (stage << 12) | min(len(path), 0xfff)
+        if skip_worktree:
+            flags |= EXTENDED
+        entry = struct.pack('>24xI12x20xH', mode, flags)
+        if skip_worktree:
+            entry += struct.pack('>H', SKIP_WORKTREE)
+        if version == 4:
+            common = len(os.path.commonprefix([previous, path]))
+            entry += encode_offset(len(previous) - common) + path[common:] + '\0'
+        else:
+            entry += path
+            entry += '\0' * (8 - len(entry) % 8)
+        data += entry
+        previous = path
+    # The checksum at the end isn't read
+    return data + '\0' * 20
+
+
+def file_entry(path, stage=0, skip_worktree=False, mode=FILE_MODE):
+    return (path, mode, stage, skip_worktree)
+
+
+class ReadIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, version, entries):
+        path = os.path.join(self.directory, 'index')
+        f = open(path, 'wb')
+        try:
+            f.write(build_index(version, entries))
+        finally:
+            f.close()
+        return git_index.read_index(path)
+
+    def test_versions(self):
+        entries = [file_entry('Gemfile'),
+                   file_entry('app/models/admin/user.rb'),
+                   file_entry('app/models/user.rb'),
+                   file_entry('app/views/users/index.html.erb')]
+        for version in (2, 3, 4):
+            self.assertEqual(self.read(version, entries),
+                             ['Gemfile', 'app/models/admin/user.rb', 'app/models/user.rb',
+                              'app/views/users/index.html.erb'])
+
+    def test_padding(self):
+        # Paths of every length modulo eight, so that entries end on every
+        # possible boundary
+        paths = ['app/%s.rb' % ('a' * length) for length in range(1, 17)]
+        paths.sort()
+        for version in (2, 3):
+            self.assertEqual(self.read(version, [file_entry(path) for path in paths]), paths)
+
+    def test_long_prefix_compression(self):
+        # A path that drops more than 127 characters of the one before it
+        # takes a multi-byte offset
+        long_path = 'app/' + '/'.join(['directory'] * 20) + '/file.rb'
+        entries = [file_entry(long_path), file_entry('config/routes.rb')]
+        self.assertEqual(self.read(4, entries), [long_path, 'config/routes.rb'])
+
+    def test_skip_worktree(self):
+        entries = [file_entry('app/models/user.rb'),
+                   file_entry('docs/guide.md', skip_worktree=True),
+                   file_entry('lib/tasks/setup.rake')]
+        for version in (3, 4):
+            self.assertEqual(self.read(version, entries), ['app/models/user.rb', 'lib/tasks/setup.rake'])
+
+    def test_conflict_stages(self):
+        entries = [file_entry('app/models/post.rb'),
+                   file_entry('app/models/user.rb', stage=1),
+                   file_entry('app/models/user.rb', stage=2),
+                   file_entry('app/models/user.rb', stage=3),
+                   file_entry('config/routes.rb')]
+        for version in (2, 3, 4):
+            self.assertEqual(self.read(version, entries),
+                             ['app/models/post.rb', 'app/models/user.rb', 'config/routes.rb'])
+
+    def test_gitlinks_and_directories(self):
+        entries = [file_entry('Gemfile'),
+                   file_entry('vendor/engine', mode=git_index.GITLINK_MODE),
+                   file_entry('vendor/sparse', mode=git_index.DIRECTORY_MODE),
+                   file_entry('vendor/tool.rb')]
+        for version in (2, 3, 4):
+            self.assertEqual(self.read(version, entries), ['Gemfile', 'vendor/tool.rb'])
+
+    def test_unsupported(self):
+        path = os.path.join(self.directory, 'index')
+        f = open(path, 'wb')
+        try:
+            f.write(struct.pack('>4sII', 'DIRC', 5, 0))
+        finally:
+            f.close()
+        self.assertRaises(ValueError, git_index.read_index, path)
+
+
+class ReadOffsetTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in (0, 1, 127, 128, 255, 16511, 16512, 1000000):
+            self.assertEqual(git_index.read_offset(encode_offset(value) + 'x', 0),
+                             (value, len(encode_offset(value))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# Tests for parsing routes files and looking routes up by name, URL and
+# controller#action, with fixtures written to a temporary Rails root.
+#
+#   python -m unittest discover tests
+#
+# Like the plugin itself, this needs Python 2.
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routes_index
+from lib.inflector import Inflector
+
+inflector = Inflector()
+
+ROUTES = '''Rails.application.routes.draw do
+  root 'home#index'
+
+  concern :commentable do
+    resources :comments, only: [:index, :create]
+  end
+  concern :archivable do
+    member do
+      post :archive
+    end
+  end
+
+  namespace :admin, path: 'backoffice' do
+    resources :users, only: [:index, :show]
+  end
+  namespace :api, path: '/', as: 'v1' do
+    resources :tokens, only: [:index, :create]
+  end
+
+  resources :posts, concerns: [:commentable, :archivable]
+  resources :articles, path: 'stories', except: [:destroy] do
+    concerns :commentable
+    get :preview, on: :member
+  end
+  resources :photos, only: [:index, :show], path: 'pictures'
+  resource :profile, only: :show
+
+  get 'files/*path' => 'files#show'
+  draw :extra
+end
+'''
+
+EXTRA_ROUTES = '''get 'about' => 'pages#about', as: :about
+'''
+
+
+class RoutesIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'config', 'routes'))
+        self.write(os.path.join('config', 'routes.rb'), ROUTES)
+        self.write(os.path.join('config', 'routes', 'extra.rb'), EXTRA_ROUTES)
+        self.index = routes_index.RoutesIndex(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, file, source):
+        f = open(os.path.join(self.root, file), 'w')
+        try:
+            f.write(source)
+        finally:
+            f.close()
+
+    def routes(self, name):
+        return [(route.verb, route.path, route.target())
+                for route in self.index.by_name(name, inflector)]
+
+    def targets_of(self, url):
+        return [route.target() for route in self.index.by_url(url, inflector)]
+
+    def test_root(self):
+        self.assertEqual(self.routes('root_path'), [('GET', '/', 'home#index')])
+
+    def test_namespace_path(self):
+        self.assertEqual(self.routes('admin_users'), [('GET', '/backoffice/users', 'admin/users#index')])
+        self.assertEqual(self.routes('admin_user'), [('GET', '/backoffice/users/:id', 'admin/users#show')])
+        self.assertEqual(self.routes('v1_tokens'), [('GET', '/tokens', 'api/tokens#index')])
+        self.assertEqual(self.targets_of('/tokens'), ['api/tokens#index', 'api/tokens#create'])
+
+    def test_concerns_option(self):
+        self.assertEqual(self.routes('post_comments'), [('GET', '/posts/:post_id/comments', 'comments#index')])
+        self.assertEqual(self.routes('archive_post'), [('POST', '/posts/:id/archive', 'posts#archive')])
+        # The concerns add no routes where they are defined
+        self.assertEqual(self.routes('comments'), [])
+
+    def test_concerns_statement(self):
+        self.assertEqual(self.routes('article_comments'),
+                         [('GET', '/stories/:article_id/comments', 'comments#index')])
+        self.assertEqual(self.routes('preview_article'), [('GET', '/stories/:id/preview', 'articles#preview')])
+        self.assertEqual(self.routes('archive_article'), [])
+
+    def test_concern_lines(self):
+        route = self.index.by_name('post_comments', inflector)[0]
+        self.assertEqual((route.file, route.line), (os.path.join('config', 'routes.rb'), 5))
+
+    def test_only_and_except(self):
+        targets = [route.target() for route in self.index.by_target('photos#index', inflector) +
+                   self.index.by_target('photos#show', inflector) +
+                   self.index.by_target('photos#edit', inflector)]
+        self.assertEqual(targets, ['photos#index', 'photos#show'])
+        self.assertEqual(self.index.by_target('articles#destroy', inflector), [])
+        self.assertEqual(self.routes('profile'), [('GET', '/profile', 'profiles#show')])
+        self.assertEqual(self.routes('edit_profile'), [])
+
+    def test_resources_path(self):
+        self.assertEqual(self.routes('photos'), [('GET', '/pictures', 'photos#index')])
+        self.assertEqual(self.routes('edit_article'), [('GET', '/stories/:id/edit', 'articles#edit')])
+
+    def test_url_matching(self):
+        self.assertEqual(self.targets_of('http://localhost:3000/pictures/12?size=large'), ['photos#show'])
+        self.assertEqual(self.targets_of('/backoffice/users/'), ['admin/users#index'])
+        self.assertEqual(self.targets_of('/stories/7/comments.json'), ['comments#index', 'comments#create'])
+        self.assertEqual(self.targets_of('/files/reports/2024/summary.pdf'), ['files#show'])
+        self.assertEqual(self.targets_of('/files'), [])
+        self.assertEqual(self.targets_of('/pictures/12/edit'), [])
+
+    def test_draw(self):
+        self.assertEqual(self.routes('about_url'), [('GET', '/about', 'pages#about')])
+        route = self.index.by_name('about', inflector)[0]
+        self.assertEqual(route.file, os.path.join('config', 'routes', 'extra.rb'))
+
+    def test_changes(self):
+        self.assertEqual(self.routes('about'), [('GET', '/about', 'pages#about')])
+        self.write(os.path.join('config', 'routes', 'extra.rb'), "get 'team' => 'pages#team', as: :team\n")
+        # The mtime has to change for the file to be read again
+        mtime = os.path.getmtime(os.path.join(self.root, 'config', 'routes', 'extra.rb'))
+        os.utime(os.path.join(self.root, 'config', 'routes', 'extra.rb'), (mtime + 10, mtime + 10))
+        self.assertEqual(self.routes('about'), [])
+        self.assertEqual(self.routes('team'), [('GET', '/team', 'pages#team')])
+
+
+class PathPatternTest(unittest.TestCase):
+    def test_parameters(self):
+        pattern = routes_index.path_pattern('/users/:user_id/posts/:id')
+        self.assertTrue(re.match(pattern, '/users/3/posts/4'))
+        self.assertFalse(re.match(pattern, '/users/3/posts/4/edit'))
+        self.assertFalse(re.match(pattern, '/users/3/posts'))
+
+    def test_globs(self):
+        pattern = routes_index.path_pattern('/docs/*path')
+        self.assertTrue(re.match(pattern, '/docs/guides/routing'))
+        self.assertFalse(re.match(pattern, '/docs/'))
+
+
+if __name__ == '__main__':
+    unittest.main()